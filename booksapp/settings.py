@@ -47,11 +47,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'catalog.instrumentation.PerformanceMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'catalog.database.ReplicaMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
 
@@ -62,7 +64,8 @@ ROOT_URLCONF = 'booksapp.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The standard backend, with render times recorded for catalog.instrumentation.
+        'BACKEND': 'catalog.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': ['./templates',],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,6 +77,8 @@ TEMPLATES = [
 
                 'social_django.context_processors.backends',
                 'social_django.context_processors.login_redirect',
+
+                'catalog.context_processors.cache_versions',
             ],
         },
     },
@@ -93,6 +98,47 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# Per-process memory is fine for trying things out, but each gunicorn worker and
+# worker command then has its own cache, and a change made in one isn't seen by
+# the others' cached pages; catalog.caching caps every cached entry at
+# CATALOG_LOCAL_CACHE_TIMEOUT seconds with it. Point this at memcached or redis
+# in production, so all processes share pages and version stamps.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'booksapp',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# How long author autocomplete answers (catalog.autocomplete) are cached, in seconds;
+# a changed author replaces them sooner.
+CATALOG_AUTOCOMPLETE_CACHE_TIMEOUT = 300
+
+# Admin changelists (catalog.admin) show the database's row estimate instead of
+# a COUNT(*) for unfiltered tables with more rows than this.
+CATALOG_EXACT_COUNT_LIMIT = 100000
+
+# Sessions are read from the cache and written through to the database. Only
+# logged-in users get one: nothing the anonymous pages do stores anything in
+# the session. The expire_sessions command removes the expired rows.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# How long browsers and shared caches (a CDN) may keep the home page of an
+# anonymous visitor, in seconds.
+CATALOG_INDEX_MAX_AGE = 60
+
+# Cached catalog pages and fragments (catalog.caching) are keyed by model version
+# stamps, so this only limits how long unused entries are kept.
+CATALOG_PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+# The most any catalog cache entry is kept with the per-process cache above,
+# which is also how long other processes may show data from before a change.
+CATALOG_LOCAL_CACHE_TIMEOUT = 60
+
+
 AUTHENTICATION_BACKENDS = [
         'social_core.backends.github.GithubOAuth2',
         'social_core.backends.twitter.TwitterOAuth',
@@ -141,6 +187,68 @@ LOGIN_REDIRECT_URL = 'index'
 LOGOUT_URL = 'logout'
 LOGOUT_REDIRECT_URL = 'login'
 
+# Home page counters (catalog.stats): cache lifetime in seconds, and whether to
+# keep running counter rows instead of counting the tables.
+CATALOG_STATS_CACHE_TIMEOUT = 300
+CATALOG_STATS_USE_COUNTERS = False
+
+# Outbox (catalog.outbox): give up on a message after this many tries, waiting
+# CATALOG_EMAIL_RETRY_SECONDS, then twice as long each time, between them.
+CATALOG_EMAIL_MAX_ATTEMPTS = 5
+CATALOG_EMAIL_RETRY_SECONDS = 60
+# How long a worker keeps the batch it claimed before another may send it.
+CATALOG_EMAIL_LEASE_SECONDS = 600
+
+# Overdue loans (catalog.overdue): days between reminders about the same copy.
+CATALOG_OVERDUE_REMINDER_DAYS = 7
+
+# Resized book covers (catalog.covers): WEBP, falling back to JPEG if Pillow can't write it.
+CATALOG_COVER_FORMAT = 'WEBP'
+
+# How long a reviewer keeps the books they claim from the review queue (catalog.reviews).
+CATALOG_REVIEW_LEASE_MINUTES = 30
+
+# Request instrumentation (catalog.instrumentation): the most queries each URL name
+# may run, counting the 4 lookups of a logged-in librarian: session, user, and
+# their user and group permissions for the sidebar.
+# Over budget logs a warning, or raises with CATALOG_QUERY_BUDGET_STRICT, which
+# catalog.tests turns on.
+CATALOG_QUERY_BUDGETS = {
+    'index': 8,
+    'books': 9,
+    # The view's own 2 (the book with its author, its copies) and a librarian's 4.
+    'book-detail': 6,
+    'authors': 5,
+    'author-detail': 6,
+    'readedbooks': 5,
+    'readedbook-detail': 5,
+    'search': 6,
+    'most-borrowed': 8,
+    'loan-trends': 4,
+    'my-borrowed': 5,
+    'my-holds': 5,
+    'all-borrowed': 5,
+    'overdue-borrowed': 5,
+    'review-books': 6,
+    'author-autocomplete': 6,
+}
+CATALOG_QUERY_BUDGET_STRICT = False
+# Bearer token a Prometheus scraper sends to read /catalog/metrics/
+# (Authorization: Bearer <token>); with none set the metrics aren't served.
+CATALOG_METRICS_TOKEN = os.environ.get('CATALOG_METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # One JSON line per request (catalog.tests only lets the budget warnings through).
+        'catalog.performance': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 # Add to test email:
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
@@ -149,6 +257,34 @@ import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
 
+# Database profile (catalog.database). SQLite connections are tuned with the
+# pragmas in catalog.database.DEFAULT_PRAGMAS as they are opened; set
+# CATALOG_SQLITE_PRAGMAS to a dict to change some of them, e.g.
+# {'busy_timeout': 10000} (milliseconds), or {'journal_mode': None} to skip one.
+
+# Connection reuse, from DATABASE_POOL in the environment:
+#   persistent - keep each worker's connection open for good (CONN_MAX_AGE=None);
+#   pgbouncer  - PostgreSQL behind pgbouncer in transaction pooling mode, which
+#                does the pooling, so Django opens a connection per request and
+#                doesn't use server-side cursors (they don't survive pooling).
+# Otherwise connections are reused for CONN_MAX_AGE seconds, as set above.
+DATABASE_POOL = os.environ.get('DATABASE_POOL', '')
+if DATABASE_POOL == 'persistent':
+    DATABASES['default']['CONN_MAX_AGE'] = None
+elif DATABASE_POOL == 'pgbouncer':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# A read replica, from DATABASE_REPLICA_URL. The views named in
+# catalog.database.DEFAULT_REPLICA_VIEWS, or in CATALOG_REPLICA_VIEWS if set,
+# read the catalog from it; all writes and every other view use default.
+if os.environ.get('DATABASE_REPLICA_URL'):
+    DATABASES['replica'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'},
+                                **dj_database_url.parse(os.environ['DATABASE_REPLICA_URL'],
+                                                        conn_max_age=DATABASES['default'].get('CONN_MAX_AGE', 0)))
+CATALOG_REPLICA_DATABASE = 'replica'
+DATABASE_ROUTERS = ['catalog.database.ReplicaRouter']
+
 
 
 # Static files (CSS, JavaScript, Images)
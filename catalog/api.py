@@ -0,0 +1,105 @@
+"""
+Read-only REST API for the catalog.
+
+Every response carries a strong ETag; object responses also carry a
+Last-Modified taken from the latest updated_at of the rows they show (a
+book's and its author's, see validator_fields). Both are worked out before
+anything is loaded or serialized, so a client polling with If-None-Match /
+If-Modified-Since gets a 304 cheaply: an object's from one small query, a
+list's from the version stamps of the models it shows (see catalog.caching)
+and the query string, without touching the database. Only when a stamp has
+been evicted is a list's ETag worked out from its rows, with one aggregate;
+the stamps are started again then, so the next poll misses once and the
+ones after it are cheap again.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework import viewsets
+from rest_framework.pagination import CursorPagination
+
+from .caching import get_versions, stored_versions
+from .models import Author, Book, ReadedBook
+from .serializers import AuthorSerializer, BookSerializer, ReadedBookSerializer
+
+
+class CatalogPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 50
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+class ConditionalGetMixin:
+    """Answers GET with 304 Not Modified when the client's copy is still current."""
+
+    def representation_key(self, request):
+        # The same rows rendered with other ?fields= or another format are a different entity.
+        return (request.get_full_path(), request.META.get('HTTP_ACCEPT', ''))
+
+    # The models whose version stamps change whenever a list response could; none means always aggregate.
+    version_models = ()
+    # The updated_at of every row a response shows, so that changing any of them changes the validators.
+    validator_fields = ('updated_at',)
+
+    def list_state(self):
+        versions = stored_versions(*self.version_models) if self.version_models else None
+        if versions is not None:
+            return sorted(versions.items())
+        state = self.filter_queryset(self.get_queryset()).order_by().aggregate(
+            count=Count('pk'), top=Max('pk'), **{'last_' + name: Max(name) for name in self.validator_fields})
+        # Start the stamps, so the next request can use them.
+        get_versions(*self.version_models)
+        return sorted(state.items())
+
+    def list(self, request, *args, **kwargs):
+        etag = make_etag(self.queryset.model._meta.label, self.list_state(), *self.representation_key(request))
+        return (get_conditional_response(request, etag=etag)
+                or self.tag(super().list(request, *args, **kwargs), etag))
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = {self.lookup_field: kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        found = self.get_queryset().filter(**lookup).values_list(*self.validator_fields).first()
+        if found is None:
+            return super().retrieve(request, *args, **kwargs)  # the usual 404
+        # A book without an author has no author__updated_at.
+        last = max(stamp for stamp in found if stamp is not None)
+        etag = make_etag(self.queryset.model._meta.label, kwargs, last.isoformat(),
+                         *self.representation_key(request))
+        last_modified = int(last.timestamp())
+        return (get_conditional_response(request, etag=etag, last_modified=last_modified)
+                or self.tag(super().retrieve(request, *args, **kwargs), etag, last_modified))
+
+    def tag(self, response, etag, last_modified=None):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+
+class AuthorViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Author.objects.all()
+    serializer_class = AuthorSerializer
+    pagination_class = CatalogPagination
+    version_models = (Author,)
+
+
+class BookViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Book.objects.select_related('author')
+    serializer_class = BookSerializer
+    pagination_class = CatalogPagination
+    # The author's name and the copy counts are part of each book.
+    version_models = (Book, Author, ReadedBook)
+    validator_fields = ('updated_at', 'author__updated_at')
+
+
+class ReadedBookViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = ReadedBook.objects.all()
+    serializer_class = ReadedBookSerializer
+    pagination_class = CatalogPagination
+    version_models = (ReadedBook,)
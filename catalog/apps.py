@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class CatalogConfig(AppConfig):
     name = 'catalog'
+
+    def ready(self):
+        # Connect the signal receivers that keep derived data up to date,
+        # and the one that tunes new SQLite connections.
+        from . import availability, caching, circulation, covers, database, holds, search, stats  # noqa: F401
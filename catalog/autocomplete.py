@@ -0,0 +1,92 @@
+"""
+Author autocomplete for the book forms.
+
+The book forms used to render author as a <select> of every author. Now they
+use AuthorAutocompleteWidget, which asks the author-autocomplete view for
+the authors whose last or first name starts with what was typed. Names are
+matched on Author.last_name_key / first_name_key, folded by name_key(), with
+range conditions (key >= prefix AND key < prefix + U+10FFFF) that seek the
+author_last_key_idx / author_first_key_idx indexes; LIKE 'prefix%' would
+read the whole index on SQLite. Each lookup is a few capped index seeks, and
+the answer is cached for a short while under the Author version stamp.
+"""
+import hashlib
+
+from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.urls import reverse_lazy
+
+from .caching import bounded_timeout, get_versions
+from .models import Author, name_key
+
+MAX_RESULTS = 10
+MIN_PREFIX = 1
+
+# Sorts after every character a key can contain.
+HIGHEST = '\U0010ffff'
+
+
+def cache_timeout():
+    return bounded_timeout(getattr(settings, 'CATALOG_AUTOCOMPLETE_CACHE_TIMEOUT', 300))
+
+
+def _prefix(field, prefix):
+    return Q(**{field + '__gte': prefix, field + '__lt': prefix + HIGHEST})
+
+
+def match_authors(query, limit=MAX_RESULTS):
+    """
+    Authors whose last name, first name, or "first last" / "last first" starts with query.
+
+    Last-name matches come first, each group in index order; at most limit authors.
+    """
+    key = name_key(query)[:100]
+    if len(key) < MIN_PREFIX:
+        return []
+    conditions = [(_prefix('last_name_key', key), ('last_name_key', 'first_name_key', 'id')),
+                  (_prefix('first_name_key', key), ('first_name_key', 'last_name_key', 'id'))]
+    if ' ' in key:
+        head, tail = key.split(' ', 1)
+        conditions += [(Q(first_name_key=head) & _prefix('last_name_key', tail),
+                        ('first_name_key', 'last_name_key', 'id')),
+                       (Q(last_name_key=head) & _prefix('first_name_key', tail),
+                        ('last_name_key', 'first_name_key', 'id'))]
+    found = []
+    for condition, ordering in conditions:
+        if len(found) >= limit:
+            break
+        found += (Author.objects.filter(condition).exclude(pk__in=[author.pk for author in found])
+                  .order_by(*ordering)[:limit - len(found)])
+    return found
+
+
+def author_suggestions(query):
+    """[{'id', 'text'}] for match_authors(query), cached until an author changes or the timeout."""
+    versions = get_versions(Author)
+    key = 'catalog:authors:{0}:{1}'.format(
+        versions['author'], hashlib.sha1(name_key(query).encode()).hexdigest())
+    suggestions = cache.get(key)
+    if suggestions is None:
+        suggestions = [{'id': author.pk, 'text': str(author)} for author in match_authors(query)]
+        cache.set(key, suggestions, cache_timeout())
+    return suggestions
+
+
+class AuthorAutocompleteWidget(forms.Widget):
+    """
+    A text box suggesting authors as you type, in place of a <select> of them all.
+
+    The chosen author's id goes in a hidden input under the field's name, so
+    the form field stays a ModelChoiceField. Rendering looks up only the
+    selected author.
+    """
+    template_name = 'catalog/widgets/author_autocomplete.html'
+    url = reverse_lazy('author-autocomplete')
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        author = Author.objects.filter(pk=value).first() if str(value).isdigit() else None
+        context['widget'].update({'text': str(author) if author else '', 'url': str(self.url)})
+        return context
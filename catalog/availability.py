@@ -0,0 +1,130 @@
+"""
+Per-book copy counters: Book.copies_total, copies_available and copies_on_loan.
+
+Every change to a copy's book or status moves the counters of the books
+concerned with an UPDATE ... SET n = n + 1, so concurrent changes add up
+instead of overwriting each other, and lists can show and sort by
+availability without touching the copies table. Copies changed through
+save() or delete() are counted by the receivers below. Queryset updates and
+bulk inserts call move_copies() / add_copies() themselves. The
+reconcile_copy_counters command recounts the counters and repairs any drift.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Book, ReadedBook
+
+# The counter each copy status adds to, besides copies_total.
+STATUS_COUNTERS = {'a': 'copies_available', 'o': 'copies_on_loan'}
+
+
+def counters(status):
+    names = ['copies_total']
+    if status in STATUS_COUNTERS:
+        names.append(STATUS_COUNTERS[status])
+    return names
+
+
+def apply(deltas):
+    """Apply {(book id, counter name): delta}, one UPDATE per book."""
+    by_book = {}
+    for (book_id, name), delta in deltas.items():
+        if book_id is not None and delta:
+            by_book.setdefault(book_id, {})[name] = F(name) + delta
+    for book_id, changes in by_book.items():
+        Book.objects.filter(pk=book_id).update(updated_at=timezone.now(), **changes)
+
+
+def move(deltas, book_id, status, sign):
+    for name in counters(status):
+        deltas[book_id, name] += sign
+
+
+def move_copies(rows, new_status):
+    """Count copies changed by a queryset update; rows are (book id, old status) pairs."""
+    deltas = Counter()
+    for book_id, status in rows:
+        move(deltas, book_id, status, -1)
+        move(deltas, book_id, new_status, 1)
+    apply(deltas)
+
+
+def add_copies(copies):
+    """Count copies created with bulk_create."""
+    deltas = Counter()
+    for copy in copies:
+        move(deltas, copy.book_id, copy.status, 1)
+    apply(deltas)
+
+
+@receiver(post_init, sender=ReadedBook)
+def remember_counted(sender, instance, **kwargs):
+    values = instance.__dict__
+    instance._counted = (values.get('book_id'), values.get('status'))
+
+
+@receiver(post_save, sender=ReadedBook)
+def copy_saved(sender, instance, created, raw=False, **kwargs):
+    counted = (instance.book_id, instance.status)
+    if not raw and (created or counted != instance._counted):
+        deltas = Counter()
+        if not created:
+            move(deltas, *instance._counted, sign=-1)
+        move(deltas, *counted, sign=1)
+        apply(deltas)
+    instance._counted = counted
+
+
+@receiver(post_delete, sender=ReadedBook)
+def copy_deleted(sender, instance, **kwargs):
+    deltas = Counter()
+    move(deltas, *instance._counted, sign=-1)
+    apply(deltas)
+
+
+def true_counts(books):
+    """The counters as they should be for the given books queryset."""
+    return books.annotate(
+        true_total=Count('readedbook'),
+        true_available=Count('readedbook', filter=Q(readedbook__status='a')),
+        true_on_loan=Count('readedbook', filter=Q(readedbook__status='o')),
+    )
+
+
+def fix_book(pk):
+    """Overwrite one book's counters with a fresh count."""
+    with transaction.atomic():
+        # Lock the book first: a copy change in flight either finishes before
+        # the count sees it, or waits and adds its increment after the fix.
+        list(Book.objects.select_for_update().filter(pk=pk).values_list('pk'))
+        fresh = true_counts(Book.objects.filter(pk=pk)).values_list(
+            'true_total', 'true_available', 'true_on_loan').get()
+        Book.objects.filter(pk=pk).update(updated_at=timezone.now(), **dict(zip(Book.COPY_COUNTERS, fresh)))
+
+
+def reconcile(batch_size=1000, fix=False):
+    """
+    Recount the counters of every book, batch_size books at a time.
+
+    Returns the ids of the books whose counters were wrong; with fix=True
+    they are corrected too.
+    """
+    drifted = []
+    last = 0
+    while True:
+        batch = list(true_counts(Book.objects.filter(pk__gt=last).order_by('pk'))
+                     .values_list('pk', *Book.COPY_COUNTERS, 'true_total', 'true_available', 'true_on_loan')
+                     [:batch_size])
+        if not batch:
+            return drifted
+        for pk, total, available, on_loan, *true in batch:
+            if [total, available, on_loan] != true:
+                drifted.append(pk)
+                if fix:
+                    fix_book(pk)
+        last = batch[-1][0]
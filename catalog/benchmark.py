@@ -0,0 +1,287 @@
+"""
+Benchmarks for the catalog pages.
+
+seed() fills the database with a synthetic catalog of a given size: authors,
+books through catalog.bulk (so they are searchable), copies in bulk with
+their counters, and borrowers with loans, some of them overdue. run() then
+requests each page in ENDPOINTS many times, either in process through the
+Django test client or over HTTP against a running server, and reports the
+p50 and p99 latency, the throughput and, in process, the queries per
+request. Results are plain dicts meant to be saved as JSON; compare() lists
+what got worse between two of them.
+
+Use the seed_catalog and benchmark_views commands rather than calling these
+directly, and point them at a database you can throw away.
+"""
+import datetime
+import math
+import platform
+import random
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import islice
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Permission, User
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from . import availability, bulk, caching, stats
+from .instrumentation import RequestStats
+from .models import Author, Book, ReadedBook
+
+SCALES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+
+BENCH_USER = 'bench-librarian'
+
+# The pages measured, by URL name (see endpoint_urls).
+ENDPOINTS = ('index', 'books', 'book-detail', 'author-detail', 'all-borrowed', 'my-borrowed')
+
+# The ones that only redirect to the login page when logged out; run() skips them then.
+LOGIN_ENDPOINTS = ('all-borrowed', 'my-borrowed')
+
+# How much worse a timing may get before compare() reports it: 0.2 is 20%.
+DEFAULT_TOLERANCE = 0.2
+
+BATCH = 1000
+
+
+def _batches(objects, size=BATCH):
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _book_rows(n, authors, rng):
+    catagories = [value for value, label in Book.CATAGORY_CHOICES]
+    for i in range(n):
+        author = rng.randrange(authors)
+        yield {'title': 'Book {0}'.format(i), 'author_first_name': 'First{0}'.format(author),
+               'author_last_name': 'Last{0}'.format(author), 'catagory': rng.choice(catagories),
+               'is_favourite': '1' if rng.random() < 0.05 else ''}
+
+
+def seed(books, copies, authors=None, borrowers=100, seed=0, progress=None):
+    """
+    Add a synthetic catalog of the given size; returns the benchmark user.
+
+    About a third of the copies are on loan, a tenth of those overdue, and
+    some are on loan to the benchmark user, so every page has rows to show.
+    """
+    rng = random.Random(seed)
+    authors = authors or max(1, books // 10)
+    started = time.monotonic()
+
+    def report(what, n):
+        if progress:
+            progress(what, n, time.monotonic() - started)
+
+    user, created = User.objects.get_or_create(username=BENCH_USER, defaults={'is_staff': True})
+    if created:
+        user.set_unusable_password()
+        user.save()
+    user.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+    password = make_password(None)
+    first = User.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    User.objects.bulk_create(User(username='bench-reader-{0}-{1}'.format(first, i), password=password)
+                             for i in range(borrowers))
+    readers = list(User.objects.filter(pk__gt=first).values_list('pk', flat=True)) + [user.pk]
+    report('borrowers', len(readers))
+
+    high_water = Book.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    bulk.import_rows('books', _book_rows(books, authors, rng), batch_size=BATCH)
+    book_ids = list(Book.objects.filter(pk__gt=high_water).order_by('pk').values_list('pk', flat=True))
+    report('books', len(book_ids))
+
+    today = datetime.date.today()
+    done = 0
+
+    def new_copies():
+        for i in range(copies):
+            # Every book gets a copy before any gets a second one.
+            book_id = book_ids[i] if i < len(book_ids) else rng.choice(book_ids)
+            roll = rng.random()
+            if roll < 0.33:
+                yield ReadedBook(book_id=book_id, imprint='Bench', status='o', borrower_id=rng.choice(readers),
+                                 due_back=today + datetime.timedelta(days=rng.randint(-3, 27)))
+            else:
+                yield ReadedBook(book_id=book_id, imprint='Bench', status='a' if roll < 0.9 else 'd')
+
+    for batch in _batches(new_copies() if book_ids else []):
+        with transaction.atomic():
+            ReadedBook.objects.bulk_create(batch)
+            availability.add_copies(batch)
+        done += len(batch)
+        report('copies', done)
+
+    stats.invalidate(recount=True)
+    for model in (Book, Author, ReadedBook):
+        caching.bump_version(model)
+    return user
+
+
+def _sample_ids(model, n, rng):
+    """Up to n ids spread over the table, found with one index seek each."""
+    bounds = model.objects.order_by('pk').values_list('pk', flat=True)
+    low, high = bounds.first(), bounds.last()
+    if low is None:
+        return []
+    return sorted({bounds.filter(pk__gte=rng.randint(low, high)).first() for _ in range(n)})
+
+
+def endpoint_urls(rng, samples=20):
+    """{endpoint: [url, ...]}; the requests for an endpoint take turns over its urls."""
+    return {
+        'index': [reverse('index')],
+        'books': [reverse('books')],
+        'book-detail': [reverse('book-detail', args=[pk]) for pk in _sample_ids(Book, samples, rng)],
+        'author-detail': [reverse('author-detail', args=[pk]) for pk in _sample_ids(Author, samples, rng)],
+        'all-borrowed': [reverse('all-borrowed')],
+        'my-borrowed': [reverse('my-borrowed')],
+    }
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of values, p in 0..100."""
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def _summary(timings, queries, statuses, elapsed):
+    return {
+        'requests': len(timings),
+        # Anything but a 200, redirects included: they aren't the page being measured.
+        'errors': sum(n for status, n in statuses.items() if status != 200),
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'throughput_rps': round(len(timings) / elapsed, 2) if elapsed else None,
+        'queries': max(queries) if queries else None,
+    }
+
+
+class InProcess:
+    """Requests through the test client, counting each request's queries on every connection."""
+
+    mode = 'client'
+
+    def __init__(self, user=None):
+        self.anonymous = user is None
+        host = next((host for host in settings.ALLOWED_HOSTS if host not in ('*',) and not host.startswith('.')),
+                    'localhost')
+        self.client = Client(HTTP_HOST=host)
+        if user is not None:
+            self.client.force_login(user)
+
+    def fetch(self, url):
+        request_stats = RequestStats()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(request_stats))
+            started = time.perf_counter()
+            response = self.client.get(url)
+            seconds = time.perf_counter() - started
+        return seconds, response.status_code, request_stats.queries
+
+
+class OverHttp:
+    """Requests to a running server; the queries are in its catalog.performance log, not here."""
+
+    mode = 'http'
+
+    def __init__(self, base_url, cookie=None):
+        self.anonymous = not cookie
+        self.base_url = base_url.rstrip('/')
+        self.headers = {'Cookie': cookie} if cookie else {}
+
+    def fetch(self, url):
+        request = urllib.request.Request(self.base_url + url, headers=self.headers)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as exc:
+            status = exc.code
+        return time.perf_counter() - started, status, None
+
+
+def measure(target, urls, requests, warmup=5, concurrency=1):
+    """Request the urls in turn; returns the summary for one endpoint."""
+    for i in range(warmup):
+        target.fetch(urls[i % len(urls)])
+    plan = [urls[i % len(urls)] for i in range(requests)]
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(target.fetch, plan))
+    else:
+        results = [target.fetch(url) for url in plan]
+    elapsed = time.perf_counter() - started
+    timings = [seconds for seconds, status, queries in results]
+    queries = [queries for seconds, status, queries in results if queries is not None]
+    statuses = Counter(status for seconds, status, queries in results)
+    return _summary(timings, queries, statuses, elapsed)
+
+
+def run(target, endpoints=ENDPOINTS, requests=100, warmup=5, concurrency=1, seed=0):
+    """Benchmark each endpoint; returns the results document."""
+    urls = endpoint_urls(random.Random(seed))
+    results = {}
+    skipped = [name for name in endpoints if target.anonymous and name in LOGIN_ENDPOINTS]
+    for name in endpoints:
+        if urls[name] and name not in skipped:
+            results[name] = measure(target, urls[name], requests, warmup, concurrency)
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'mode': target.mode,
+            'requests': requests,
+            'concurrency': concurrency,
+            'anonymous': target.anonymous,
+            'skipped': skipped,
+            'database': connection.vendor,
+            'books': Book.objects.count(),
+            'copies': ReadedBook.objects.count(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    """
+    What got worse from baseline to current, as [(endpoint, metric, before, after)].
+
+    Latency may grow and throughput shrink by tolerance before it counts;
+    any extra query per request counts.
+    """
+    regressions = []
+    for name, after in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            if after[metric] > before[metric] * (1 + tolerance):
+                regressions.append((name, metric, before[metric], after[metric]))
+        if before.get('throughput_rps') and after['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append((name, 'throughput_rps', before['throughput_rps'], after['throughput_rps']))
+        if before.get('queries') is not None and after.get('queries') is not None \
+                and after['queries'] > before['queries']:
+            regressions.append((name, 'queries', before['queries'], after['queries']))
+        if after['errors'] > before.get('errors', 0):
+            regressions.append((name, 'errors', before.get('errors', 0), after['errors']))
+    return regressions
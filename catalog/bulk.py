@@ -0,0 +1,193 @@
+"""
+Bulk import and export of authors, books and copies as CSV or JSON lines.
+
+Rows are streamed: they are read, converted and written with bulk_create one
+batch (and one transaction) at a time, and exported with a server-side
+iterator, so memory use stays flat whatever the size of the file. Books name
+their author by first and last name, resolved through an in-memory map of
+every author, and authors that don't exist yet are created on the way.
+"""
+import csv
+import json
+import time
+from itertools import islice
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils.dateparse import parse_date
+
+from . import availability, caching, search, stats
+from .models import Author, Book, ReadedBook
+
+FORMATS = ('csv', 'jsonl')
+
+COLUMNS = {
+    'authors': ['id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death'],
+    'books': ['id', 'title', 'author_first_name', 'author_last_name', 'catagory', 'review', 'is_favourite'],
+    'copies': ['id', 'book_id', 'imprint', 'status', 'due_back'],
+}
+
+# What each export column is read from.
+EXPORT_VALUES = {
+    'authors': (Author, COLUMNS['authors']),
+    'books': (Book, ['id', 'title', 'author__first_name', 'author__last_name', 'catagory', 'review',
+                     'is_favourite']),
+    'copies': (ReadedBook, ['id', 'book_id', 'imprint', 'status', 'due_back']),
+}
+
+
+class RowError(ValueError):
+    """A row that can't be imported; the message says which one and why."""
+
+
+def read_rows(stream, fmt):
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_rows(stream, fmt, columns, rows):
+    """Write tuples of values under the given column names; returns the number written."""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(columns)
+        for count, row in enumerate(rows, 1):
+            writer.writerow(['' if value is None else value for value in row])
+    else:
+        for count, row in enumerate(rows, 1):
+            stream.write(json.dumps(dict(zip(columns, row)), default=str) + '\n')
+    return count
+
+
+def export_rows(kind, chunk_size=2000):
+    """Every row of one kind, in id order, read from the database in chunks."""
+    model, values = EXPORT_VALUES[kind]
+    return model.objects.order_by('pk').values_list(*values).iterator(chunk_size=chunk_size)
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _text(row, key):
+    value = row.get(key)
+    return '' if value is None else str(value).strip()
+
+
+def _date(row, key, line):
+    value = _text(row, key)
+    if not value:
+        return None
+    parsed = parse_date(value)
+    if parsed is None:
+        raise RowError('Row {0}: {1} is not a date: {2!r}'.format(line, key, value))
+    return parsed
+
+
+def _choice(row, key, choices, line, default=None):
+    value = _text(row, key)
+    if not value and default is not None:
+        return default
+    for code, label in choices:
+        if value in (code, label):
+            return code
+    raise RowError('Row {0}: unknown {1} {2!r}'.format(line, key, value))
+
+
+class AuthorMap:
+    """(last name, first name) -> Author id for every author, creating the missing ones in bulk."""
+
+    def __init__(self):
+        self.ids = {(last, first): pk for pk, last, first in
+                    Author.objects.values_list('pk', 'last_name', 'first_name').iterator(chunk_size=5000)}
+
+    def resolve(self, names):
+        missing = {name for name in names if name not in self.ids}
+        if missing:
+            Author.objects.bulk_create(Author(last_name=last, first_name=first).fill_name_keys()
+                                      for last, first in missing)
+            # bulk_create only returns primary keys on PostgreSQL, so read them back.
+            created = Author.objects.filter(last_name__in={last for last, _ in missing},
+                                            first_name__in={first for _, first in missing})
+            for pk, last, first in created.values_list('pk', 'last_name', 'first_name'):
+                if (last, first) in missing:
+                    self.ids.setdefault((last, first), pk)
+        return self.ids
+
+
+def _build(kind, batch, first_line, keep_ids, authors):
+    objects = []
+    if kind == 'books':
+        names = [(_text(row, 'author_last_name'), _text(row, 'author_first_name')) for row in batch]
+        author_ids = authors.resolve({name for name in names if any(name)})
+    for line, row in enumerate(batch, first_line):
+        pk = int(row['id']) if keep_ids and _text(row, 'id') else None
+        if kind == 'authors':
+            objects.append(Author(
+                pk=pk, first_name=_text(row, 'first_name'), last_name=_text(row, 'last_name'),
+                date_of_birth=_date(row, 'date_of_birth', line),
+                date_of_death=_date(row, 'date_of_death', line)).fill_name_keys())
+        elif kind == 'books':
+            name = names[line - first_line]
+            objects.append(Book(
+                pk=pk, title=_text(row, 'title'), author_id=author_ids.get(name) if any(name) else None,
+                catagory=_choice(row, 'catagory', Book.CATAGORY_CHOICES, line),
+                review=_text(row, 'review') or None,
+                is_favourite=_text(row, 'is_favourite').lower() in ('1', 'true', 'yes')))
+        else:
+            book_id = _text(row, 'book_id')
+            objects.append(ReadedBook(
+                pk=pk, book_id=int(book_id) if book_id else None, imprint=_text(row, 'imprint'),
+                status=_choice(row, 'status', ReadedBook.LOAN_STATUS, line, default='d'),
+                due_back=_date(row, 'due_back', line)))
+    return objects
+
+
+def import_rows(kind, rows, batch_size=1000, keep_ids=False, progress=None):
+    """
+    Create the objects described by rows, one transaction per batch.
+
+    progress, if given, is called after each batch with the running total and
+    the elapsed time. Returns the number of rows imported.
+    """
+    model = EXPORT_VALUES[kind][0]
+    authors = AuthorMap() if kind == 'books' else None
+    high_water = Book.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    started, total = time.monotonic(), 0
+    for batch in _batches(rows, batch_size):
+        with transaction.atomic():
+            objects = _build(kind, batch, total + 1, keep_ids, authors)
+            model.objects.bulk_create(objects)
+            if kind == 'copies':
+                availability.add_copies(objects)
+            if kind == 'books':
+                # bulk_create sends no post_save, so index the new books here.
+                new_books = Book.objects.select_related('author').order_by('pk')
+                if keep_ids:
+                    new_books = list(new_books.filter(pk__in=[book.pk for book in objects]))
+                else:
+                    new_books = list(new_books.filter(pk__gt=high_water))
+                    high_water = new_books[-1].pk if new_books else high_water
+                search.index_books(new_books)
+        total += len(batch)
+        if progress:
+            progress(total, time.monotonic() - started)
+    if keep_ids:
+        # Move the id sequence past the imported ids (a no-op on SQLite).
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+                cursor.execute(sql)
+    stats.invalidate(recount=True)
+    caching.bump_version(model)
+    if kind == 'books':
+        caching.bump_version(Author)
+    return total
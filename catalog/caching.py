@@ -0,0 +1,140 @@
+"""
+HTML caching keyed by model version stamps.
+
+Each of Book, Author and ReadedBook has a version stamp in the cache that
+changes whenever one of its rows is saved or deleted. Cached pages and
+template fragments put the stamps of the models they show into their keys,
+so they are served until that data actually changes and never after, with no
+list of keys to hunt down and delete. The TTLs only bound how long unused
+entries take up memory.
+
+That holds as long as every process shares the cache. With a per-process
+backend (LocMemCache, the default) a change made in one gunicorn worker or
+worker command only bumps the stamps of that process, so everything cached
+is kept for at most CATALOG_LOCAL_CACHE_TIMEOUT seconds instead (see
+bounded_timeout); other processes may show the old data for that long.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Author, Book, ReadedBook
+
+VERSIONED_MODELS = (Book, Author, ReadedBook)
+
+
+def version_key(model):
+    return 'catalog:version:{0}'.format(model._meta.label_lower)
+
+
+# Backends whose entries only the process that stored them can see.
+PER_PROCESS_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def bounded_timeout(seconds):
+    """seconds, or less with a per-process cache, which other processes' changes can't invalidate."""
+    if settings.CACHES['default']['BACKEND'] in PER_PROCESS_BACKENDS:
+        return min(seconds, getattr(settings, 'CATALOG_LOCAL_CACHE_TIMEOUT', 60))
+    return seconds
+
+
+def page_timeout():
+    return bounded_timeout(getattr(settings, 'CATALOG_PAGE_CACHE_TIMEOUT', 60 * 60 * 24))
+
+
+def new_stamp():
+    # Time-based, so a stamp that was evicted never comes back with an old value.
+    return int(time.time() * 1000)
+
+
+def get_versions(*models):
+    """{model label: stamp} for the given models, in one cache round trip."""
+    keys = {version_key(model): model._meta.model_name for model in models}
+    found = cache.get_many(list(keys))
+    missing = {key: new_stamp() for key in keys if key not in found}
+    for key, stamp in missing.items():
+        # add() so two processes starting at once agree on the stamp.
+        if not cache.add(key, stamp, None):
+            missing[key] = cache.get(key, stamp)
+    found.update(missing)
+    return {name: found[key] for key, name in keys.items()}
+
+
+def stored_versions(*models):
+    """Like get_versions, but None if any of the stamps isn't in the cache, rather than starting new ones."""
+    keys = {version_key(model): model._meta.model_name for model in models}
+    found = cache.get_many(list(keys))
+    if len(found) != len(keys):
+        return None
+    return {name: found[key] for key, name in keys.items()}
+
+
+def bump_version(model):
+    try:
+        cache.incr(version_key(model))
+    except ValueError:
+        cache.set(version_key(model), new_stamp(), None)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=ReadedBook)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=ReadedBook)
+def model_changed(sender, **kwargs):
+    bump_version(sender)
+
+
+class LazyVersions:
+    """Version stamps for templates, fetched the first time one is used: {{ cache_versions.book }}."""
+
+    def __init__(self):
+        self._versions = None
+
+    def __getitem__(self, name):
+        if self._versions is None:
+            self._versions = get_versions(*VERSIONED_MODELS)
+        return self._versions[name]
+
+
+def cache_anonymous_page(*models):
+    """
+    Cache a view's response for anonymous visitors until one of the models changes.
+
+    Logged-in users, whose pages show their own sidebar, always get a fresh page.
+    Responses that set cookies or aren't a 200 are never stored.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            versions = get_versions(*models)
+            key = 'catalog:page:{0}'.format(hashlib.sha1('|'.join(
+                [request.get_full_path()] + ['{0}={1}'.format(*item) for item in sorted(versions.items())]
+            ).encode()).hexdigest())
+            response = cache.get(key)
+            if response is not None:
+                return response
+
+            response = view(request, *args, **kwargs)
+
+            def store(response):
+                # A page with a CSRF token belongs to one visitor's cookie; don't share it.
+                if (response.status_code == 200 and not response.cookies and not response.streaming
+                        and not request.META.get('CSRF_COOKIE_USED')):
+                    cache.set(key, response, page_timeout())
+
+            if hasattr(response, 'render') and callable(response.render) and not response.is_rendered:
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,144 @@
+"""
+Circulation history and the statistics rolled up from it.
+
+Every checkout, renewal and return of a copy is appended to LoanEvent: by
+the signal receivers below for copies changed through save(), and by
+record_events() for the bulk updates in catalog.loans. Events are never
+changed afterwards.
+
+The rollup_loan_events command reads the events after its checkpoint and
+adds the checkouts to BookLoanDay, AuthorLoanDay and CatagoryLoanDay, one
+row per key per day, moving the checkpoint in the same transaction. The most
+borrowed and trend pages read only those small tables, so they cost the same
+however long the history grows.
+"""
+import datetime
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .caching import bump_version
+from .models import (Author, AuthorLoanDay, Book, BookLoanDay, CatagoryLoanDay, LoanEvent, ReadedBook,
+                     RollupCheckpoint)
+
+CHECKPOINT = 'loan_days'
+
+# Events younger than this are left for the next run, so one committed late
+# by a slow transaction, with an id below the checkpoint, isn't skipped.
+SETTLE_TIME = datetime.timedelta(seconds=60)
+
+
+def record_events(kind, rows, due_back=None):
+    """Append one event per (copy id, book id, borrower id) in rows."""
+    now = timezone.now()
+    LoanEvent.objects.bulk_create([
+        LoanEvent(kind=kind, copy_id=copy_id, book_id=book_id, borrower_id=borrower_id,
+                  due_back=due_back, created_at=now)
+        for copy_id, book_id, borrower_id in rows
+    ])
+
+
+@receiver(post_init, sender=ReadedBook)
+def remember_loan(sender, instance, **kwargs):
+    values = instance.__dict__
+    instance._loan = (values.get('status'), values.get('borrower_id'), values.get('due_back'))
+
+
+@receiver(post_save, sender=ReadedBook)
+def copy_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    status, borrower_id, due_back = (None, None, None) if created else instance._loan
+    events = []
+    if status == 'o' and (instance.status != 'o' or instance.borrower_id != borrower_id):
+        events.append(LoanEvent(kind=LoanEvent.RETURN, copy=instance, book_id=instance.book_id,
+                                borrower_id=borrower_id))
+    if instance.status == 'o' and (status != 'o' or instance.borrower_id != borrower_id):
+        events.append(LoanEvent(kind=LoanEvent.CHECKOUT, copy=instance, book_id=instance.book_id,
+                                borrower_id=instance.borrower_id, due_back=instance.due_back))
+    elif instance.status == 'o' and instance.due_back != due_back:
+        events.append(LoanEvent(kind=LoanEvent.RENEW, copy=instance, book_id=instance.book_id,
+                                borrower_id=instance.borrower_id, due_back=instance.due_back))
+    if events:
+        LoanEvent.objects.bulk_create(events)
+    instance._loan = (instance.status, instance.borrower_id, instance.due_back)
+
+
+def _add(model, key, counts):
+    for (value, day), loans in counts.items():
+        updated = model.objects.filter(**{key: value, 'day': day}).update(loans=F('loans') + loans)
+        if not updated:
+            model.objects.create(**{key: value, 'day': day, 'loans': loans})
+
+
+def roll_up(batch_size=5000, until=None):
+    """Add the next batch of settled events to the rollup tables; returns how many events were read."""
+    until = until or timezone.now() - SETTLE_TIME
+    with transaction.atomic():
+        checkpoint, _ = RollupCheckpoint.objects.get_or_create(name=CHECKPOINT)
+        # Lock it, so two runs can't count the same events.
+        checkpoint = RollupCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+        events = list(LoanEvent.objects
+                      .filter(pk__gt=checkpoint.last_event_id, created_at__lt=until)
+                      .order_by('pk')
+                      .values_list('pk', 'kind', 'book_id', 'book__author_id', 'book__catagory', 'created_at')
+                      [:batch_size])
+        if not events:
+            return 0
+        books, authors, catagories = Counter(), Counter(), Counter()
+        for pk, kind, book_id, author_id, catagory, created_at in events:
+            if kind != LoanEvent.CHECKOUT or book_id is None:
+                continue
+            day = timezone.localdate(created_at)
+            books[book_id, day] += 1
+            if author_id is not None:
+                authors[author_id, day] += 1
+            catagories[catagory, day] += 1
+        _add(BookLoanDay, 'book_id', books)
+        _add(AuthorLoanDay, 'author_id', authors)
+        _add(CatagoryLoanDay, 'catagory', catagories)
+        checkpoint.last_event_id = events[-1][0]
+        checkpoint.save(update_fields=['last_event_id'])
+    bump_version(BookLoanDay)
+    return len(events)
+
+
+def since(days):
+    return timezone.localdate() - datetime.timedelta(days=days - 1)
+
+
+def _top(model, key, days, limit):
+    return list(model.objects.filter(day__gte=since(days))
+                .values_list(key).annotate(loans=Sum('loans')).order_by('-loans', key)[:limit])
+
+
+def most_borrowed(days=30, limit=10):
+    """The most borrowed books, authors and catagories of the last days, as [(object, loans)] lists."""
+    books = _top(BookLoanDay, 'book', days, limit)
+    authors = _top(AuthorLoanDay, 'author', days, limit)
+    book_map = Book.objects.select_related('author').in_bulk([pk for pk, loans in books])
+    author_map = Author.objects.in_bulk([pk for pk, loans in authors])
+    labels = dict(Book.CATAGORY_CHOICES)
+    return {
+        'books': [(book_map[pk], loans) for pk, loans in books if pk in book_map],
+        'authors': [(author_map[pk], loans) for pk, loans in authors if pk in author_map],
+        'catagories': [(labels.get(catagory, catagory), loans)
+                       for catagory, loans in _top(CatagoryLoanDay, 'catagory', days, limit)],
+    }
+
+
+def catagory_trends(days=30):
+    """[(day, [loans per catagory])] for each of the last days, and the catagory labels in column order."""
+    first = since(days)
+    counts = dict(((catagory, day), loans) for catagory, day, loans in
+                  CatagoryLoanDay.objects.filter(day__gte=first).values_list('catagory', 'day', 'loans'))
+    catagories = [value for value, label in Book.CATAGORY_CHOICES]
+    rows = []
+    for offset in range(days):
+        day = first + datetime.timedelta(days=offset)
+        rows.append((day, [counts.get((catagory, day), 0) for catagory in catagories]))
+    return rows, [label for value, label in Book.CATAGORY_CHOICES]
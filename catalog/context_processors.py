@@ -0,0 +1,9 @@
+from .caching import LazyVersions, page_timeout
+
+
+def cache_versions(request):
+    """Model version stamps and a timeout for {% cache %} fragments (see catalog.caching)."""
+    return {
+        'cache_versions': LazyVersions(),
+        'fragment_cache_timeout': page_timeout(),
+    }
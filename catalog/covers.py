@@ -0,0 +1,114 @@
+"""
+Resized copies of book covers.
+
+When a book is saved with a new cover, a CoverThumbnailJob is queued; the
+process_cover_thumbnails worker then makes a list-size and a detail-size
+image with Pillow and records their storage names on the book
+(Book.cover_list_url / Book.cover_detail_url). Files are named after a hash
+of their content, so they can be cached forever and identical covers are
+stored once.
+"""
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from PIL import Image, features
+
+from .caching import bump_version
+from .models import Book, CoverThumbnailJob
+
+# Bounding boxes, twice the size the templates display them at for high-density screens.
+SIZES = {
+    'list': (200, 300),
+    'detail': (600, 900),
+}
+
+THUMBNAIL_DIR = 'books/covers/thumbs/'
+
+# What make_thumbnails raises for a cover it can't resize: unreadable, not an
+# image, or so large that decoding it could exhaust memory.
+IMAGE_ERRORS = (IOError, OSError, ValueError, Image.DecompressionBombError)
+
+
+def thumbnail_format():
+    """WEBP where Pillow can write it, otherwise JPEG."""
+    wanted = getattr(settings, 'CATALOG_COVER_FORMAT', 'WEBP')
+    if wanted == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return wanted
+
+
+def render_thumbnail(image, size, fmt):
+    thumbnail = image.copy()
+    thumbnail.thumbnail(size, Image.LANCZOS)
+    out = io.BytesIO()
+    thumbnail.save(out, fmt, quality=82, optimize=True)
+    return out.getvalue()
+
+
+def store(data, suffix, fmt):
+    """Save the bytes under a name derived from their hash; returns the storage name."""
+    extension = 'webp' if fmt == 'WEBP' else 'jpg'
+    name = '{0}{1}-{2}.{3}'.format(THUMBNAIL_DIR, hashlib.sha1(data).hexdigest()[:20], suffix, extension)
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+def make_thumbnails(book):
+    """Resize the book's cover and record the results; returns False if the cover changed meanwhile."""
+    cover_name = book.cover.name
+    with book.cover.open('rb') as cover:
+        image = Image.open(cover)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    fmt = thumbnail_format()
+    if fmt == 'JPEG' and image.mode == 'RGBA':
+        image = image.convert('RGB')
+    names = {kind: store(render_thumbnail(image, size, fmt), kind, fmt) for kind, size in SIZES.items()}
+    # update() rather than save(): no signals, and no clobbering a cover uploaded in the meantime.
+    updated = Book.objects.filter(pk=book.pk, cover=cover_name).update(
+        cover_list=names['list'], cover_detail=names['detail'], updated_at=timezone.now())
+    if updated:
+        bump_version(Book)
+    return bool(updated)
+
+
+def process_jobs(batch_size=20):
+    """Resize the covers of the oldest queued books; returns how many jobs were handled."""
+    jobs = list(CoverThumbnailJob.objects.select_related('book').order_by('queued_at')[:batch_size])
+    for job in jobs:
+        if job.book.cover:
+            try:
+                make_thumbnails(job.book)
+            except IMAGE_ERRORS:
+                # Not an image Pillow can read, or too large to; the list shows the original instead.
+                pass
+        CoverThumbnailJob.objects.filter(pk=job.pk, queued_at=job.queued_at).delete()
+    return len(jobs)
+
+
+@receiver(post_init, sender=Book)
+def remember_cover(sender, instance, **kwargs):
+    cover = instance.__dict__.get('cover')
+    instance._saved_cover = getattr(cover, 'name', cover) or ''
+
+
+@receiver(post_save, sender=Book)
+def queue_thumbnails(sender, instance, created, raw=False, **kwargs):
+    name = instance.cover.name if instance.cover else ''
+    if raw or (name == instance._saved_cover and not created):
+        return
+    instance._saved_cover = name
+    if instance.cover_list or instance.cover_detail:
+        # The old thumbnails show the old cover; use the original until the new ones are made.
+        Book.objects.filter(pk=instance.pk).update(cover_list='', cover_detail='')
+        instance.cover_list = instance.cover_detail = ''
+    if name:
+        CoverThumbnailJob.objects.update_or_create(book=instance, defaults={'queued_at': timezone.now()})
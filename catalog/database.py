@@ -0,0 +1,105 @@
+"""
+Database profile: SQLite tuning and routing reads to a replica.
+
+SQLite connections get DEFAULT_PRAGMAS as soon as they are opened: WAL, so
+readers don't wait for the writer and the writer doesn't wait for readers;
+synchronous=NORMAL, which is safe with WAL and saves an fsync per commit; a
+memory-mapped read path; and a busy timeout so a writer queued behind another
+waits instead of failing with "database is locked". CATALOG_SQLITE_PRAGMAS
+overrides some of them; None leaves one unset.
+
+When a CATALOG_REPLICA_DATABASE alias is configured (DATABASE_REPLICA_URL in
+the environment, see the settings), ReplicaMiddleware marks anonymous GET
+requests to the read-only views in CATALOG_REPLICA_VIEWS (DEFAULT_REPLICA_VIEWS
+unless set) and ReplicaRouter sends their catalog reads to the replica.
+Everything else, and every write, stays on default. Only logged-in users
+change the catalog, and their pages are always read from default, so nobody
+is redirected after a change to a page that doesn't show it yet.
+"""
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 5000,
+}
+
+DEFAULT_REPLICA_VIEWS = (
+    'books', 'book-detail', 'authors', 'author-detail', 'search', 'most-borrowed', 'loan-trends',
+)
+
+_state = threading.local()
+
+
+def sqlite_pragmas():
+    """DEFAULT_PRAGMAS with the CATALOG_SQLITE_PRAGMAS overrides applied."""
+    pragmas = dict(DEFAULT_PRAGMAS, **getattr(settings, 'CATALOG_SQLITE_PRAGMAS', {}))
+    return {name: value for name, value in pragmas.items() if value is not None}
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+
+
+def replica_alias():
+    """The replica's alias, if one is configured."""
+    alias = getattr(settings, 'CATALOG_REPLICA_DATABASE', 'replica')
+    return alias if alias != DEFAULT_DB_ALIAS and alias in connections.databases else None
+
+
+class ReplicaMiddleware:
+    """Lets ReplicaRouter send the reads of anonymous visitors' read-only catalog views to the replica."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            _state.use_replica = False
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        views = getattr(settings, 'CATALOG_REPLICA_VIEWS', DEFAULT_REPLICA_VIEWS)
+        _state.use_replica = (request.method in ('GET', 'HEAD')
+                              and request.resolver_match.url_name in views
+                              and not request.user.is_authenticated)
+
+
+class ReplicaRouter:
+    """Catalog reads of the views ReplicaMiddleware marked go to the replica; the rest is left to default."""
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'use_replica', False) and model._meta.app_label == 'catalog':
+            return replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Django would otherwise save an object where it was read from.
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db is not None and instance._state.db == replica_alias():
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # The replica is a copy of default, migrated through it.
+        if db == replica_alias():
+            return False
+        return None
@@ -0,0 +1,120 @@
+"""
+Filters and facet counts for the book list.
+
+The list can be narrowed by catagory, author, favourites and availability
+(?catagory=...&author=...&favourite=1&available=1). Next to it each facet
+shows how many books each of its values would leave. Every facet is counted
+with one grouped query over the books matching the other filters, and the
+counts are cached per filter combination, keyed by the Book, Author and
+ReadedBook version stamps (see catalog.caching), so they are only recounted
+after the catalog changes; the author facet shows the authors' names.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.http import QueryDict
+
+from .caching import get_versions, page_timeout
+from .models import Author, Book, ReadedBook
+
+FILTERS = ('catagory', 'author', 'favourite', 'available')
+
+# Authors listed in the author facet, the ones with the most books first.
+MAX_AUTHORS = 10
+
+
+def parse_filters(params):
+    """The valid filters among the request's GET parameters; anything else is ignored."""
+    filters = {}
+    # Like the facet, any stored value goes, not just Book.CATAGORY_CHOICES; one no book has matches nothing.
+    catagory = params.get('catagory', '')
+    if 0 < len(catagory) <= Book._meta.get_field('catagory').max_length:
+        filters['catagory'] = catagory
+    author = params.get('author', '')
+    if author.isdigit():
+        filters['author'] = int(author)
+    for flag in ('favourite', 'available'):
+        if params.get(flag) == '1':
+            filters[flag] = True
+    return filters
+
+
+def filter_books(queryset, filters, skip=None):
+    """Apply the filters, leaving out the one named skip."""
+    conditions = {
+        'catagory': lambda value: Q(catagory=value),
+        'author': lambda value: Q(author_id=value),
+        'favourite': lambda value: Q(is_favourite=True),
+        'available': lambda value: Q(copies_available__gt=0),
+    }
+    for name, value in filters.items():
+        if name != skip:
+            queryset = queryset.filter(conditions[name](value))
+    return queryset
+
+
+def count_facets(filters):
+    """Count every facet, one grouped query each."""
+    books = Book.objects.order_by()
+    labels = dict(Book.CATAGORY_CHOICES)
+    catagories = (filter_books(books, filters, skip='catagory')
+                  .values_list('catagory').annotate(n=Count('id')).order_by('catagory'))
+    authors = (filter_books(books, filters, skip='author').filter(author__isnull=False)
+               .values_list('author', 'author__first_name', 'author__last_name')
+               .annotate(n=Count('id')).order_by('-n', 'author__last_name')[:MAX_AUTHORS])
+    favourite = filter_books(books, filters, skip='favourite').aggregate(n=Count('id', filter=Q(is_favourite=True)))
+    available = filter_books(books, filters, skip='available').aggregate(
+        n=Count('id', filter=Q(copies_available__gt=0)))
+    return {
+        'catagory': [(value, labels.get(value, value), n) for value, n in catagories],
+        'author': [(pk, '{0}, {1}'.format(last, first), n) for pk, first, last, n in authors],
+        'favourite': favourite['n'],
+        'available': available['n'],
+    }
+
+
+def facet_counts(filters):
+    """count_facets(filters), from the cache until a book, author or copy changes."""
+    versions = get_versions(Author, Book, ReadedBook)
+    key = 'catalog:facets:{0}'.format(hashlib.sha1(repr(
+        (sorted(filters.items()), sorted(versions.items()))).encode()).hexdigest())
+    counts = cache.get(key)
+    if counts is None:
+        counts = count_facets(filters)
+        cache.set(key, counts, page_timeout())
+    return counts
+
+
+def _query(params, name, value):
+    """The query string back at the first page, with parameter name set to value, or removed if None."""
+    params = params.copy()
+    for key in ('cursor', 'page', name):
+        params.pop(key, None)
+    if value is not None:
+        params[name] = value
+    return params.urlencode()
+
+
+def _toggle(params, name, value):
+    """The query string with filter name set to value, or removed if it has that value already."""
+    return _query(params, name, None if params.get(name) == str(value) else value)
+
+
+def facets(params, filters):
+    """The facets for the template: lists of {label, count, selected, query}, and the sort and clear links."""
+    counts = facet_counts(filters)
+
+    def option(name, value, label, count):
+        return {'label': label, 'count': count, 'selected': filters.get(name) == value,
+                'query': _toggle(params, name, value if not isinstance(value, bool) else 1)}
+
+    return {
+        'catagory': [option('catagory', value, label, n) for value, label, n in counts['catagory']],
+        'author': [option('author', pk, name, n) for pk, name, n in counts['author']],
+        'flags': [option('available', True, 'Available now', counts['available']),
+                  option('favourite', True, 'Favourites', counts['favourite'])],
+        'any_selected': bool(filters),
+        'clear_query': _query(QueryDict(), 'sort', params.get('sort')),
+        'sort_queries': {'title': _query(params, 'sort', None), 'available': _query(params, 'sort', 'available')},
+    }
@@ -5,7 +5,10 @@ import datetime  # for checking renewal date range.
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 
-from .models import Book
+from .autocomplete import AuthorAutocompleteWidget
+from .loans import MAX_BULK_COPIES
+from .reviews import MAX_CLAIM
+from .models import Book, ReadedBook
 from django import forms
 
 
@@ -37,22 +40,126 @@ class RenewBookForm(forms.Form):
 
     def clean_renewal_date(self):
         data = self.cleaned_data['renewal_date']
-
-        # Check date is not in past.
-        if data < datetime.date.today():
-            raise ValidationError(_('Invalid date - renewal in past'))
-        # Check date is in range book catalog allowed to change (+4 weeks)
-        if data > datetime.date.today() + datetime.timedelta(weeks=4):
-            raise ValidationError(
-                _('Invalid date - renewal more than 4 weeks ahead'))
+        check_renewal_date(data)
 
         # Remember to always return the cleaned data.
         return data
 
+
+def check_renewal_date(data):
+    """The renewal rules shared by RenewBookForm and BulkLoanForm."""
+    # Check date is not in past.
+    if data < datetime.date.today():
+        raise ValidationError(_('Invalid date - renewal in past'))
+    # Check date is in range book catalog allowed to change (+4 weeks)
+    if data > datetime.date.today() + datetime.timedelta(weeks=4):
+        raise ValidationError(
+            _('Invalid date - renewal more than 4 weeks ahead'))
+
+
+class CopyIdsWidget(forms.Textarea):
+    """A text box of copy ids, which also collects the values of several checkboxes of the same name."""
+
+    def value_from_datadict(self, data, files, name):
+        if hasattr(data, 'getlist'):
+            return ' '.join(data.getlist(name))
+        return data.get(name)
+
+
+class BulkLoanForm(forms.Form):
+    """Form for a librarian to renew or return many copies at once."""
+    ACTIONS = (
+        ('renew', 'Renew'),
+        ('return', 'Mark returned'),
+    )
+
+    copies = forms.CharField(
+        widget=CopyIdsWidget(attrs={'rows': 4}),
+        help_text="Copy ids, separated by spaces or commas.")
+    action = forms.ChoiceField(choices=ACTIONS)
+    renewal_date = forms.DateField(
+        required=False,
+        help_text="Needed to renew: a date between now and 4 weeks.")
+
+    def clean_copies(self):
+        try:
+            ids = sorted({int(value) for value in self.cleaned_data['copies'].replace(',', ' ').split()})
+        except ValueError:
+            raise ValidationError(_('Enter copy ids as whole numbers.'))
+        if not ids:
+            raise ValidationError(_('Enter at least one copy id.'))
+        if len(ids) > MAX_BULK_COPIES:
+            raise ValidationError(_('At most %(max)d copies at a time.'), params={'max': MAX_BULK_COPIES})
+        return ids
+
+    def clean_renewal_date(self):
+        data = self.cleaned_data['renewal_date']
+        if data is not None:
+            check_renewal_date(data)
+        return data
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('action') == 'renew' and not cleaned_data.get('renewal_date') \
+                and 'renewal_date' not in self.errors:
+            self.add_error('renewal_date', _('Enter the date to renew the copies until.'))
+        return cleaned_data
+
+class LendCopyForm(forms.Form):
+    """Form for a librarian to lend a copy, based on the version of it they were shown."""
+    borrower = forms.CharField(help_text="The reader's username.")
+    due_back = forms.DateField(help_text="Enter a date between now and 4 weeks (default 3).")
+    version = forms.IntegerField(widget=forms.HiddenInput)
+
+    def clean_borrower(self):
+        user = User.objects.filter(username=self.cleaned_data['borrower']).first()
+        if user is None:
+            raise ValidationError(_('There is no reader with that username.'))
+        return user
+
+    def clean_due_back(self):
+        data = self.cleaned_data['due_back']
+        check_renewal_date(data)
+        return data
+
+
+class ReturnCopyForm(forms.Form):
+    """Confirms taking back a copy, based on the version of it the librarian was shown."""
+    version = forms.IntegerField(widget=forms.HiddenInput)
+
+
+class ReadedBookForm(forms.ModelForm):
+    """Edit a copy, remembering which version of it the form was filled in from."""
+    version = forms.IntegerField(widget=forms.HiddenInput)
+
+    class Meta:
+        model = ReadedBook
+        fields = ['book', 'imprint', 'due_back', 'borrower', 'status']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['version'].initial = self.instance.version
+
+
+class ClaimReviewsForm(forms.Form):
+    """How many books to claim from the review queue."""
+    count = forms.IntegerField(min_value=1, max_value=MAX_CLAIM, initial=10, label='Books')
+
+
 class BookForm(forms.ModelForm):
     class Meta:
         model = Book
         fields = ['title', 'author', 'cover', 'catagory', 'reviewed_by']
+        widgets = {'author': AuthorAutocompleteWidget}
+
+
+class BookEditForm(forms.ModelForm):
+    """The book create and update pages."""
+    class Meta:
+        model = Book
+        fields = ['cover', 'title', 'catagory', 'author']
+        widgets = {'author': AuthorAutocompleteWidget}
 
 
 class SignUpForm(UserCreationForm):
@@ -0,0 +1,155 @@
+"""
+Holds: readers queueing for the next copy of a book.
+
+Each book has a first-come, first-served queue of Hold rows. When copies
+come back (loans.return_copies, or any save that makes a copy Available, such
+as loans.return_copy or a librarian editing it) or a hold holding a copy is
+cancelled, assign_copies() gives them to the oldest waiting holds in the
+same transaction, marks them Reserved and emails the readers through the
+outbox. Finding the next hold is one seek on hold_queue_idx, a partial index
+over the waiting holds only, so it costs the same with ten holds or ten
+thousand. Once the reserved copy is lent to its reader or made available
+again, the hold it was kept for is done and is deleted. loans.change_copy
+refuses to lend it to anyone else; if a save does so anyway (the admin),
+the hold goes back to the head of the queue and takes the next free copy.
+"""
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, When
+from django.db.models.signals import post_init, post_save, pre_delete
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import availability, stats
+from .caching import bump_version
+from .models import Book, Hold, ReadedBook
+from .outbox import queue_email
+
+
+def waiting_holds(book_id):
+    return Hold.objects.filter(book_id=book_id, assigned_at__isnull=True).order_by('created_at', 'id')
+
+
+def with_positions(queryset):
+    """Annotate holds with their place in their book's queue: 1 is next, None means a copy is waiting."""
+    ahead = (Hold.objects
+             # A range on created_at alone, so it's a count over hold_queue_idx; holds placed
+             # in the same microsecond share a position.
+             .filter(book=OuterRef('book'), assigned_at__isnull=True, created_at__lte=OuterRef('created_at'))
+             .order_by()
+             .values('book')
+             .annotate(n=Count('pk'))
+             .values('n'))
+    return queryset.annotate(position=Case(When(assigned_at__isnull=True, then=Subquery(ahead)),
+                                           default=None, output_field=IntegerField()))
+
+
+def assign_copies(book_id, copy_ids):
+    """
+    Give copies of a book that have just come free to the oldest holds on it.
+
+    The copies given to a hold are marked Reserved and the rest Available.
+    Call it in the transaction that freed the copies. Returns the holds filled.
+    """
+    if not copy_ids:
+        return []
+    copy_ids = sorted(copy_ids)
+    queryset = waiting_holds(book_id).select_related('user')
+    if connection.features.has_select_for_update_skip_locked:
+        # Two returns of the same title at once take different holds.
+        of = ('self',) if connection.features.has_select_for_update_of else ()
+        queryset = queryset.select_for_update(skip_locked=True, of=of)
+    holds = list(queryset[:len(copy_ids)])
+    now = timezone.now()
+    for hold, copy_id in zip(holds, copy_ids):
+        Hold.objects.filter(pk=hold.pk).update(copy_id=copy_id, assigned_at=now)
+        hold.copy_id, hold.assigned_at = copy_id, now
+
+    reserved, released = copy_ids[:len(holds)], copy_ids[len(holds):]
+    statuses = dict(ReadedBook.objects.filter(pk__in=copy_ids).values_list('pk', 'status'))
+    released = [pk for pk in released if statuses.get(pk) != 'a']
+    if reserved:
+        ReadedBook.objects.filter(pk__in=reserved).update(
+            status='r', updated_at=now, version=F('version') + 1)
+        availability.move_copies([(book_id, statuses.get(pk)) for pk in reserved], 'r')
+    if released:
+        ReadedBook.objects.filter(pk__in=released).update(
+            status='a', updated_at=now, version=F('version') + 1)
+        availability.move_copies([(book_id, statuses.get(pk)) for pk in released], 'a')
+    if stats.use_counters():
+        stats.bump({'num_instances_available': len(released) - sum(
+            statuses.get(pk) == 'a' for pk in reserved)})
+    stats.invalidate()
+    bump_version(ReadedBook)
+
+    if holds:
+        title = Book.objects.values_list('title', flat=True).get(pk=book_id)
+        for hold in holds:
+            if hold.user.email:
+                queue_email('Your hold on {0} is ready'.format(title),
+                            render_to_string('catalog/email/hold_ready.txt', {'hold': hold, 'title': title}),
+                            [hold.user.email])
+    return holds
+
+
+def place_hold(book, user):
+    """Join the queue for a book; an available copy is put aside straight away. Returns the Hold."""
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                hold = Hold.objects.create(book=book, user=user)
+        except IntegrityError:
+            return Hold.objects.get(book=book, user=user)
+        available = ReadedBook.objects.filter(book=book, status='a').order_by('pk')
+        if connection.features.has_select_for_update_skip_locked:
+            available = available.select_for_update(skip_locked=True)
+        copy_id = available.values_list('pk', flat=True).first()
+        if copy_id:
+            assign_copies(book.pk, [copy_id])
+            hold.refresh_from_db()
+    return hold
+
+
+def cancel_hold(hold):
+    """Leave the queue, passing on the copy kept for the hold, if any."""
+    with transaction.atomic():
+        deleted, _ = Hold.objects.filter(pk=hold.pk).delete()
+        if deleted and hold.copy_id:
+            assign_copies(hold.book_id, [hold.copy_id])
+
+
+@receiver(post_init, sender=ReadedBook)
+def remember_hold_status(sender, instance, **kwargs):
+    instance._hold_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=ReadedBook)
+def reserved_copy_saved(sender, instance, created, raw=False, **kwargs):
+    was = None if created else instance._hold_status
+    instance._hold_status = instance.status
+    if raw:
+        return
+    if was == 'r' and instance.status != 'r':
+        hold = Hold.objects.filter(copy=instance).values_list('pk', 'user_id').first()
+        if hold and instance.status == 'o' and instance.borrower_id != hold[1]:
+            # Lent to someone else: the reader keeps their place and waits for another copy.
+            with transaction.atomic():
+                Hold.objects.filter(pk=hold[0]).update(copy=None, assigned_at=None)
+                spare = (ReadedBook.objects.filter(book_id=instance.book_id, status='a')
+                         .order_by('pk').values_list('pk', flat=True).first())
+                if spare:
+                    assign_copies(instance.book_id, [spare])
+        elif hold:
+            # Lent to the reader, or put back on the shelf by hand: either way the hold is over.
+            Hold.objects.filter(pk=hold[0]).delete()
+    elif was != 'a' and instance.status == 'a' and waiting_holds(instance.book_id).exists():
+        # Returned, back from maintenance or new; the instance keeps saying Available,
+        # so that the receivers after this one count the save they were sent.
+        with transaction.atomic():
+            assign_copies(instance.book_id, [instance.pk])
+
+
+@receiver(pre_delete, sender=ReadedBook)
+def reserved_copy_deleting(sender, instance, **kwargs):
+    # The hold goes back to its old place in the queue to wait for another copy.
+    Hold.objects.filter(copy=instance).update(copy=None, assigned_at=None)
@@ -0,0 +1,32 @@
+from django.db import models
+
+# Databases that can build an index over part of a table.
+PARTIAL_INDEX_VENDORS = ('sqlite', 'postgresql')
+
+
+class PartialIndex(models.Index):
+    """
+    An Index with a WHERE clause, for Django versions whose Index has no condition.
+
+    Being a normal model index, it is recreated whenever SQLite rebuilds the
+    table. Databases without partial indexes get a plain index instead.
+    """
+
+    def __init__(self, *, where, **kwargs):
+        self.where = where
+        super().__init__(**kwargs)
+
+    def create_sql(self, model, schema_editor, using=''):
+        sql = None
+        if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+            sql = schema_editor.sql_create_index + ' WHERE ' + self.where.replace('%', '%%')
+        fields = [model._meta.get_field(field_name) for field_name, _ in self.fields_orders]
+        return schema_editor._create_index_sql(
+            model, fields, name=self.name, using=using, db_tablespace=self.db_tablespace,
+            col_suffixes=[order[1] for order in self.fields_orders], sql=sql,
+        )
+
+    def deconstruct(self):
+        path, args, kwargs = super().deconstruct()
+        kwargs['where'] = self.where
+        return path, args, kwargs
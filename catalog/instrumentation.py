@@ -0,0 +1,214 @@
+"""
+Lightweight per-request performance instrumentation, safe to run in production.
+
+PerformanceMiddleware records, for every request, the URL name, the view,
+the wall time, the number of database queries and the time spent in them,
+and the time spent rendering templates (measured by InstrumentedDjangoTemplates,
+the template backend configured in settings). Each request is logged as one
+JSON line on the 'catalog.performance' logger and added to in-process totals
+that the metrics view serves in the Prometheus text format to scrapers holding
+CATALOG_METRICS_TOKEN.
+
+CATALOG_QUERY_BUDGETS caps the number of queries a view may run, e.g.
+{'book-detail': 3}. Going over raises QueryBudgetExceeded when
+CATALOG_QUERY_BUDGET_STRICT is on (as catalog.tests turns it on) and logs a
+warning otherwise.
+"""
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger('catalog.performance')
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view ran more queries than CATALOG_QUERY_BUDGETS allows it."""
+
+
+class RequestStats:
+    """What one request has cost so far."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper(); sees every query, even with DEBUG off.
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - started
+
+
+class Registry:
+    """Running totals per view, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = defaultdict(int)        # (view, status) -> count
+            self.buckets = defaultdict(lambda: [0] * len(BUCKETS))
+            self.seconds = defaultdict(float)
+            self.counts = defaultdict(int)
+            self.queries = defaultdict(int)
+            self.db_seconds = defaultdict(float)
+            self.template_seconds = defaultdict(float)
+            self.over_budget = defaultdict(int)
+
+    def observe(self, view, status, seconds, stats, over_budget):
+        with self.lock:
+            self.requests[view, status] += 1
+            buckets = self.buckets[view]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self.seconds[view] += seconds
+            self.counts[view] += 1
+            self.queries[view] += stats.queries
+            self.db_seconds[view] += stats.db_seconds
+            self.template_seconds[view] += stats.template_seconds
+            if over_budget:
+                self.over_budget[view] += 1
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for labels, value in samples:
+                label_text = ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                      for k, v in labels)
+                lines.append('{0}{{{1}}} {2}'.format(name, label_text, value))
+
+        with self.lock:
+            family('catalog_requests_total', 'counter', 'Requests handled, by view and status code.',
+                   [((('view', v), ('status', s)), n) for (v, s), n in sorted(self.requests.items())])
+            name = 'catalog_request_duration_seconds'
+            lines.append('# HELP {0} Wall time per request.'.format(name))
+            lines.append('# TYPE {0} histogram'.format(name))
+            for view in sorted(self.counts):
+                bounds = [str(bound) for bound in BUCKETS] + ['+Inf']
+                for bound, n in zip(bounds, self.buckets[view] + [self.counts[view]]):
+                    lines.append('{0}_bucket{{view="{1}",le="{2}"}} {3}'.format(name, view, bound, n))
+                lines.append('{0}_sum{{view="{1}"}} {2}'.format(name, view, self.seconds[view]))
+                lines.append('{0}_count{{view="{1}"}} {2}'.format(name, view, self.counts[view]))
+            family('catalog_db_queries_total', 'counter', 'Database queries run.',
+                   [((('view', v),), n) for v, n in sorted(self.queries.items())])
+            family('catalog_db_seconds_total', 'counter', 'Time spent in database queries.',
+                   [((('view', v),), n) for v, n in sorted(self.db_seconds.items())])
+            family('catalog_template_seconds_total', 'counter', 'Time spent rendering templates.',
+                   [((('view', v),), n) for v, n in sorted(self.template_seconds.items())])
+            family('catalog_query_budget_exceeded_total', 'counter', 'Requests that ran more queries than their budget.',
+                   [((('view', v),), n) for v, n in sorted(self.over_budget.items())])
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def query_budget(view_name):
+    return getattr(settings, 'CATALOG_QUERY_BUDGETS', {}).get(view_name)
+
+
+def metrics_allowed(request):
+    """
+    Only a scraper sending "Authorization: Bearer <CATALOG_METRICS_TOKEN>" may read the metrics.
+
+    With no token configured nobody may. REMOTE_ADDR isn't checked: behind a
+    reverse proxy every request seems to come from it.
+    """
+    token = getattr(settings, 'CATALOG_METRICS_TOKEN', '')
+    scheme, _, given = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and constant_time_compare(given.strip(), token)
+
+
+class PerformanceMiddleware:
+    """Measures each request; see the module docstring."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = _current.stats = RequestStats()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _current.stats = None
+        seconds = time.perf_counter() - started
+
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unresolved'
+        budget = query_budget(view_name)
+        over_budget = budget is not None and stats.queries > budget
+        registry.observe(view_name, response.status_code, seconds, stats, over_budget)
+        logger.info(json.dumps({
+            'url_name': view_name,
+            'view': match._func_path if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(seconds * 1000, 3),
+            'db_queries': stats.queries,
+            'db_ms': round(stats.db_seconds * 1000, 3),
+            'template_ms': round(stats.template_seconds * 1000, 3),
+        }, sort_keys=True))
+
+        if over_budget:
+            message = '{0} ran {1} queries, over its budget of {2}'.format(view_name, stats.queries, budget)
+            if getattr(settings, 'CATALOG_QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class TimedTemplate:
+    """Wraps a backend template so its render time is added to the current request's stats."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = getattr(_current, 'stats', None)
+        if stats is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_seconds += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing each top-level template render."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
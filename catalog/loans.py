@@ -0,0 +1,157 @@
+"""
+Lending, returning and editing copies safely under concurrent use.
+
+Single copies are changed by first claiming the row with a conditional
+UPDATE ... WHERE id = %s AND status = %s [AND version = %s]. The update takes
+the row's write lock until the transaction ends, so of two librarians lending
+the same copy exactly one wins, and the other gets a LoanConflict saying why.
+No lock is held while someone fills in a form: the form carries the version
+it was based on instead. The claimed copy is then saved normally, so the
+signal receivers (stats, caching) run as usual. Returned copies go to the
+next hold on their book, if there is one (see catalog.holds).
+
+The bulk operations lock the copies they can act on, change them all with
+one UPDATE ... WHERE id IN (...) and report which ids they touched, so
+renewing a class set takes a handful of queries rather than two per copy.
+make_available() does the same for copies coming back from maintenance.
+Being queryset updates they skip the model signals; the cache versions and
+the dashboard counters are brought up to date here instead.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import availability, circulation, holds, stats
+from .caching import bump_version
+from .models import Hold, LoanEvent, ReadedBook
+
+# Most copies one request may change, which also keeps IN (...) under SQLite's variable limit.
+MAX_BULK_COPIES = 500
+
+
+class LoanConflict(Exception):
+    """The copy isn't in the state the change was based on; the message says what it is now."""
+
+
+def _conflict(pk, expected_version, status):
+    current = ReadedBook.objects.filter(pk=pk).values('status', 'version').first()
+    if current is None:
+        return LoanConflict('This copy has been deleted.')
+    if status is not None and current['status'] != status:
+        labels = dict(ReadedBook.LOAN_STATUS)
+        return LoanConflict('This copy is {0}, not {1}.'.format(
+            labels.get(current['status'], current['status']).lower(), labels[status].lower()))
+    return LoanConflict('Someone else changed this copy after you opened it. '
+                        'Check its current details and try again.')
+
+
+def change_copy(pk, changes, expected_version=None, status=None):
+    """
+    Apply {field: value} changes to one copy; returns the saved copy.
+
+    Raises LoanConflict unless the copy still has expected_version and status
+    (when given) at the moment it is claimed, or if it would lend a reserved
+    copy to someone other than the reader it is kept for.
+    """
+    conditions = {}
+    if expected_version is not None:
+        conditions['version'] = expected_version
+    if status is not None:
+        conditions['status'] = status
+    with transaction.atomic():
+        claimed = ReadedBook.objects.filter(pk=pk, **conditions).update(updated_at=timezone.now())
+        if not claimed:
+            raise _conflict(pk, expected_version, status)
+        copy = ReadedBook.objects.get(pk=pk)
+        if copy.status == 'r' and changes.get('status') == 'o':
+            hold = Hold.objects.filter(copy=copy).select_related('user').first()
+            if hold is not None and changes.get('borrower') != hold.user:
+                raise LoanConflict('This copy is reserved for {0}.'.format(hold.user.get_username()))
+        for name, value in changes.items():
+            setattr(copy, name, value)
+        copy.save()
+    return copy
+
+
+def checkout(pk, borrower, due_back, expected_version=None):
+    """Lend an available copy; raises LoanConflict if it is no longer available."""
+    return change_copy(pk, {'status': 'o', 'borrower': borrower, 'due_back': due_back, 'reminded_on': None},
+                       expected_version, status='a')
+
+
+def return_copy(pk, expected_version=None):
+    """Take back a copy on loan, keeping it for the next hold on the book; raises LoanConflict if it isn't on loan."""
+    copy = change_copy(pk, {'status': 'a', 'borrower': None, 'due_back': None, 'reminded_on': None},
+                       expected_version, status='o')
+    # Saving it Available gave it to the next hold, if any (see catalog.holds).
+    copy.refresh_from_db()
+    return copy
+
+
+def collect_hold(hold, due_back):
+    """Lend the copy kept for a hold to its reader; raises LoanConflict if it isn't reserved any more."""
+    return change_copy(hold.copy_id, {'status': 'o', 'borrower': hold.user, 'due_back': due_back},
+                       status='r')
+
+
+def _update_copies(queryset, event, **changes):
+    """
+    Apply the changes to the rows of queryset and log them as loan events.
+
+    Returns (copy id, book id, borrower id) for each copy changed, as they were before.
+    """
+    with transaction.atomic():
+        rows = list(queryset.select_for_update().order_by('pk').values_list('pk', 'book_id', 'borrower_id'))
+        if rows:
+            ReadedBook.objects.filter(pk__in=[row[0] for row in rows]).update(
+                updated_at=timezone.now(), version=F('version') + 1, **changes)
+            circulation.record_events(event, rows, due_back=changes.get('due_back'))
+    if rows:
+        bump_version(ReadedBook)
+    return rows
+
+
+def renew_copies(ids, due_back):
+    """Move the due date of the copies on loan among ids; returns the ids renewed."""
+    rows = _update_copies(ReadedBook.objects.on_loan().filter(pk__in=ids), LoanEvent.RENEW,
+                          due_back=due_back, reminded_on=None)
+    return [row[0] for row in rows]
+
+
+def return_copies(ids):
+    """Mark the copies on loan among ids as returned, keeping them for holds first; returns the ids returned."""
+    with transaction.atomic():
+        rows = _update_copies(ReadedBook.objects.on_loan().filter(pk__in=ids), LoanEvent.RETURN,
+                              status='a', due_back=None, borrower=None, reminded_on=None)
+        if rows:
+            availability.move_copies([(book_id, 'o') for pk, book_id, borrower_id in rows], 'a')
+            if stats.use_counters():
+                stats.bump({'num_instances_available': len(rows)})
+            stats.invalidate()
+            by_book = {}
+            for pk, book_id, borrower_id in rows:
+                by_book.setdefault(book_id, []).append(pk)
+            for book_id, copy_ids in by_book.items():
+                holds.assign_copies(book_id, copy_ids)
+    return [row[0] for row in rows]
+
+
+def make_available(ids):
+    """Put the copies under maintenance among ids back on the shelf, keeping them for holds first; returns the ids."""
+    with transaction.atomic():
+        rows = list(ReadedBook.objects.filter(pk__in=ids, status='d').select_for_update()
+                    .order_by('pk').values_list('pk', 'book_id'))
+        if rows:
+            ReadedBook.objects.filter(pk__in=[pk for pk, book_id in rows]).update(
+                status='a', updated_at=timezone.now(), version=F('version') + 1)
+            availability.move_copies([(book_id, 'd') for pk, book_id in rows], 'a')
+            if stats.use_counters():
+                stats.bump({'num_instances_available': len(rows)})
+            stats.invalidate()
+            waiting = set(Hold.objects.filter(book_id__in={book_id for pk, book_id in rows}, assigned_at__isnull=True)
+                          .values_list('book_id', flat=True))
+            for book_id in waiting:
+                holds.assign_copies(book_id, [pk for pk, copy_book_id in rows if copy_book_id == book_id])
+    if rows:
+        bump_version(ReadedBook)
+    return [pk for pk, book_id in rows]
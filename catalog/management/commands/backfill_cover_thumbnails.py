@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from catalog.covers import IMAGE_ERRORS, make_thumbnails
+from catalog.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Make the resized covers for existing books that have none yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        last_pk, done, failed = 0, 0, 0
+        pending = Book.objects.exclude(cover='').filter(cover__isnull=False, cover_list='').order_by('pk')
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            for book in batch:
+                try:
+                    make_thumbnails(book)
+                    done += 1
+                except IMAGE_ERRORS as exc:
+                    failed += 1
+                    self.stderr.write('Book {0}: {1}'.format(book.pk, exc))
+            last_pk = batch[-1].pk
+        self.stdout.write('Resized {0} covers, {1} failed.'.format(done, failed))
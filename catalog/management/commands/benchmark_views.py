@@ -0,0 +1,67 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Measure latency, throughput and queries of the catalog pages, in process or against '
+            'a running server, and optionally compare with an earlier run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoints', nargs='+', choices=benchmark.ENDPOINTS, default=benchmark.ENDPOINTS)
+        parser.add_argument('--requests', type=int, default=100, help='Measured requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--url', help='Base URL of a running server, e.g. http://localhost:8000. '
+                                          'By default requests go through the test client.')
+        parser.add_argument('--cookie', help='Cookie header for --url, e.g. sessionid=...')
+        parser.add_argument('--concurrency', type=int, default=1, help='Parallel requests; --url only.')
+        parser.add_argument('--anonymous', action='store_true',
+                            help='In process, browse logged out (cached pages) instead of as {0}; '
+                                 'the pages that need a login are skipped.'.format(benchmark.BENCH_USER))
+        parser.add_argument('--output', default='-', help="JSON file to write, or '-' for standard output.")
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare with.')
+        parser.add_argument('--tolerance', type=float, default=benchmark.DEFAULT_TOLERANCE)
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            target = benchmark.OverHttp(options['url'], options['cookie'])
+        else:
+            if options['concurrency'] > 1:
+                raise CommandError('--concurrency needs --url: the test client runs one request at a time.')
+            user = None
+            if not options['anonymous']:
+                user = User.objects.filter(username=benchmark.BENCH_USER).first()
+                if user is None:
+                    raise CommandError('Run seed_catalog first, or pass --anonymous.')
+            target = benchmark.InProcess(user)
+
+        document = benchmark.run(target, options['endpoints'], options['requests'], options['warmup'],
+                                 options['concurrency'])
+        regressions = []
+        if options['compare']:
+            with open(options['compare']) as f:
+                regressions = benchmark.compare(json.load(f), document, options['tolerance'])
+            document['regressions'] = [dict(zip(('endpoint', 'metric', 'before', 'after'), regression))
+                                       for regression in regressions]
+
+        text = json.dumps(document, indent=2, sort_keys=True)
+        if options['output'] == '-':
+            self.stdout.write(text)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(text + '\n')
+            for name, result in sorted(document['results'].items()):
+                self.stdout.write('{0}: p50 {1}ms, p99 {2}ms, {3} req/s, {4} queries, status {5}'.format(
+                    name, result['p50_ms'], result['p99_ms'], result['throughput_rps'], result['queries'],
+                    ', '.join('{0} x{1}'.format(status, n) for status, n in sorted(result['statuses'].items()))))
+            for name in document['meta']['skipped']:
+                self.stdout.write('{0}: skipped, it needs a login.'.format(name))
+
+        for name, metric, before, after in regressions:
+            self.stderr.write(self.style.WARNING('{0} {1}: {2} -> {3}'.format(name, metric, before, after)))
+        if regressions and options['fail_on_regression']:
+            raise CommandError('{0} regressions against {1}.'.format(len(regressions), options['compare']))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.bulk import COLUMNS, FORMATS, export_rows, write_rows
+
+
+class Command(BaseCommand):
+    help = 'Export authors, books or copies as CSV or JSON lines, streamed in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(COLUMNS))
+        parser.add_argument('--output', '-o', default='-', help="File to write, or '-' for standard output.")
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Defaults to the file extension, or csv.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['output']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        started = time.monotonic()
+        rows = export_rows(options['kind'], options['chunk_size'])
+        if path == '-':
+            total = write_rows(self.stdout, fmt, COLUMNS[options['kind']], rows)
+        else:
+            with open(path, 'w', encoding='utf-8', newline='') as stream:
+                total = write_rows(stream, fmt, COLUMNS[options['kind']], rows)
+        elapsed = time.monotonic() - started
+        # The summary goes to stderr so it never ends up in an exported file.
+        self.stderr.write('Exported {0} {1} in {2:.1f}s ({3:.0f} rows/s).'.format(
+            total, options['kind'], elapsed, total / max(elapsed, 1e-6)))
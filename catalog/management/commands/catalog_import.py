@@ -0,0 +1,41 @@
+import io
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.bulk import COLUMNS, FORMATS, RowError, import_rows, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Import authors, books or copies from a CSV or JSON lines file, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(COLUMNS))
+        parser.add_argument('path', help="File to read, or '-' for standard input.")
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Defaults to the file extension, or csv.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--keep-ids', action='store_true',
+                            help='Use the id column as the primary key, e.g. to reload an export.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        stream = (io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='') if path == '-'
+                  else open(path, encoding='utf-8', newline=''))
+
+        def progress(total, elapsed):
+            if options['verbosity'] > 1:
+                self.stdout.write('{0} rows ({1:.0f} rows/s)'.format(total, total / max(elapsed, 1e-6)))
+
+        started = time.monotonic()
+        with stream:
+            try:
+                total = import_rows(options['kind'], read_rows(stream, fmt), options['batch_size'],
+                                    options['keep_ids'], progress)
+            except (RowError, KeyError, ValueError) as exc:
+                raise CommandError(str(exc))
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS('Imported {0} {1} in {2:.1f}s ({3:.0f} rows/s).'.format(
+            total, options['kind'], elapsed, total / max(elapsed, 1e-6))))
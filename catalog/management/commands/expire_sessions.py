@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from catalog.sessions import expire_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions in batches; run it daily from cron instead of clearsessions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = expire_sessions(options['batch_size'])
+        self.stdout.write('Deleted {0} expired sessions.'.format(deleted))
@@ -0,0 +1,77 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from catalog import views
+
+# (url name, view class, url kwargs) for every view whose queryset we check.
+CHECKED_VIEWS = [
+    ('books', views.BookListView, {}),
+    ('authors', views.AuthorListView, {}),
+    ('readedbooks', views.ReadedBookListView, {}),
+    ('my-borrowed', views.LoanedBooksByUserListView, {}),
+    ('all-borrowed', views.LoanedBooksAllListView, {}),
+    ('overdue-borrowed', views.OverdueBooksListView, {}),
+    ('book-detail', views.BookDetailView, {'pk': 1}),
+    ('author-detail', views.AuthorDetailView, {'pk': 1}),
+    ('readedbook-detail', views.ReadedBookDetailView, {'pk': 1}),
+    ('review-books', views.ReviewList, {}),
+]
+
+# Plan lines that mean a whole table is read: SQLite "SCAN <table>" without an
+# index, and PostgreSQL "Seq Scan on <table>".
+SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)(?!.*\bUSING\b)')
+POSTGRES_SCAN = re.compile(r'\bSeq Scan on (\w+)')
+SORT = re.compile(r'USE TEMP B-TREE FOR ORDER BY|\bSort\b')
+
+
+def view_queryset(view_class, kwargs, user):
+    """The queryset a view would run for its first page (or object)."""
+    view = view_class()
+    view.request = RequestFactory().get('/')
+    view.request.user = user
+    view.args, view.kwargs = (), kwargs
+    queryset = view.get_queryset()
+    if 'pk' in kwargs:
+        return queryset.filter(pk=kwargs['pk'])
+    if hasattr(view, 'order_for_paging'):
+        queryset = view.order_for_paging(queryset)
+    if getattr(view, 'paginate_by', None):
+        queryset = queryset[:view.paginate_by + 1]
+    return queryset
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the queryset of each catalog view and report full table scans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='Exit with an error if any view reads a whole table.')
+
+    def handle(self, *args, **options):
+        # An unsaved user is enough to build the per-borrower filter.
+        user = User(pk=0, username='explain')
+        flagged = []
+        for name, view_class, kwargs in CHECKED_VIEWS:
+            queryset = view_queryset(view_class, kwargs, user).using(options['database'])
+            plan = queryset.explain()
+            scans = SQLITE_SCAN.findall(plan) + POSTGRES_SCAN.findall(plan)
+            sorts = SORT.findall(plan)
+
+            if scans:
+                flagged.append(name)
+                status = self.style.ERROR('SCAN {0}'.format(', '.join(sorted(set(scans)))))
+            elif sorts:
+                status = self.style.WARNING('sort without index')
+            else:
+                status = self.style.SUCCESS('ok')
+            self.stdout.write('{0}: {1}'.format(name, status))
+            if options['verbosity'] > 1:
+                for line in plan.splitlines():
+                    self.stdout.write('    ' + line)
+
+        if flagged and options['fail_on_scan']:
+            raise CommandError('Full table scans in: {0}'.format(', '.join(flagged)))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.covers import process_jobs
+
+
+class Command(BaseCommand):
+    help = 'Make the resized covers for books queued by a cover upload.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, polling for new uploads.')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to sleep when nothing is queued (with --loop).')
+
+    def handle(self, *args, **options):
+        while True:
+            done = process_jobs(options['batch_size'])
+            if done:
+                self.stdout.write('Processed {0} covers.'.format(done))
+            if done < options['batch_size']:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from catalog.stats import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount the catalog and reset the home page counter rows.'
+
+    def handle(self, *args, **options):
+        stats = rebuild_counters()
+        for name, value in sorted(stats.items()):
+            self.stdout.write('{0}: {1}'.format(name, value))
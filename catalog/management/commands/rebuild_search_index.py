@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from catalog.models import Book
+from catalog.search import index_books
+
+
+class Command(BaseCommand):
+    help = 'Rewrite the search entry of every book, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk, total = 0, 0
+        while True:
+            batch = list(Book.objects.select_related('author')
+                         .filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                break
+            index_books(batch)
+            last_pk = batch[-1].pk
+            total += len(batch)
+        self.stdout.write('Indexed {0} books.'.format(total))
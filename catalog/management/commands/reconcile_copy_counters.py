@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from catalog.availability import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recount each book's copy counters and report (or, with --fix, repair) any that are wrong."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--fix', action='store_true', help='Correct the counters that are wrong.')
+
+    def handle(self, *args, **options):
+        drifted = reconcile(options['batch_size'], fix=options['fix'])
+        if not drifted:
+            self.stdout.write('All copy counters are correct.')
+            return
+        self.stdout.write('{0} the counters of {1} books: {2}'.format(
+            'Fixed' if options['fix'] else 'Wrong', len(drifted), ', '.join(map(str, drifted[:50]))
+            + (' ...' if len(drifted) > 50 else '')))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.circulation import roll_up
+
+
+class Command(BaseCommand):
+    help = 'Add new loan events to the per-day circulation statistics.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, polling for new events.')
+        parser.add_argument('--interval', type=float, default=60.0,
+                            help='Seconds to sleep when there are no new events (with --loop).')
+
+    def handle(self, *args, **options):
+        while True:
+            done = roll_up(options['batch_size'])
+            if done:
+                self.stdout.write('Rolled up {0} loan events.'.format(done))
+            if done < options['batch_size']:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
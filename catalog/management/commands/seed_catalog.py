@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.benchmark import SCALES, seed
+
+
+class Command(BaseCommand):
+    help = 'Add a synthetic catalog of books, copies, borrowers and loans for benchmarking. Not for real data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='10k',
+                            help='Number of books, and of copies.')
+        parser.add_argument('--books', type=int, help='Overrides --scale.')
+        parser.add_argument('--copies', type=int, help='Overrides --scale.')
+        parser.add_argument('--authors', type=int, help='Defaults to a tenth of the books.')
+        parser.add_argument('--borrowers', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        books = options['books'] if options['books'] is not None else SCALES[options['scale']]
+        copies = options['copies'] if options['copies'] is not None else SCALES[options['scale']]
+        if books < 1 or copies < 0:
+            raise CommandError('Seed at least one book.')
+
+        def progress(what, n, elapsed):
+            if options['verbosity'] > 1:
+                self.stdout.write('{0} {1} ({2:.1f}s)'.format(n, what, elapsed))
+
+        user = seed(books, copies, options['authors'], options['borrowers'], options['seed'], progress)
+        self.stdout.write(self.style.SUCCESS(
+            'Added {0} books and {1} copies; benchmark as {2}.'.format(books, copies, user.username)))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from catalog.overdue import remind_overdue
+
+
+class Command(BaseCommand):
+    help = 'Queue reminder emails for overdue loans (sent by send_queued_email).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        queued = remind_overdue(options['batch_size'])
+        self.stdout.write('Queued {0} overdue reminders.'.format(queued))
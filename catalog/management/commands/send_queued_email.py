@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.outbox import send_queued
+
+
+class Command(BaseCommand):
+    help = 'Send the email waiting in the outbox, one mail connection per batch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, polling for new mail.')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to sleep when the outbox is empty (with --loop).')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_queued(options['batch_size'])
+            if sent or failed:
+                self.stdout.write('Sent {0}, failed {1}.'.format(sent, failed))
+            if sent + failed < options['batch_size']:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,78 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Author',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_name', models.CharField(max_length=100)),
+                ('last_name', models.CharField(max_length=100)),
+                ('date_of_birth', models.DateField(blank=True, null=True)),
+                ('date_of_death', models.DateField(blank=True, null=True, verbose_name='died')),
+            ],
+            options={
+                'ordering': ['last_name', 'first_name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Book',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200)),
+                ('cover', models.ImageField(blank=True, null=True, upload_to='books/covers/')),
+                ('catagory', models.CharField(choices=[('Science book', 'Science books'), ('English book', 'English books'), ('Biology book', 'Biology books')], max_length=200)),
+                ('review', models.TextField(blank=True, null=True)),
+                ('date_reviewed', models.DateTimeField(blank=True, null=True)),
+                ('is_favourite', models.BooleanField(default=False, verbose_name='Favourite?')),
+                ('author', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='catalog.Author')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReadedBook',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('imprint', models.CharField(max_length=200)),
+                ('due_back', models.DateField(blank=True, null=True)),
+                ('status', models.CharField(blank=True, choices=[('d', 'Maintenance'), ('o', 'On loan'), ('a', 'Available'), ('r', 'Reserved')], default='d', help_text='Book availability', max_length=1)),
+                ('book', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='catalog.Book')),
+            ],
+            options={
+                'ordering': ['due_back'],
+                'permissions': (('can_mark_returned', 'Set book as returned'),),
+            },
+        ),
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bio', models.TextField(blank=True, max_length=500)),
+                ('location', models.CharField(blank=True, max_length=30)),
+                ('birth_date', models.DateField(blank=True, null=True)),
+                ('email_confirmed', models.BooleanField(default=False)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='readedbook',
+            name='borrower',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='reviewed_by',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reviews', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
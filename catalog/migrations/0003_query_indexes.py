@@ -0,0 +1,49 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+# Django 2.1's Index has no condition, so the partial index is plain SQL.
+# SQLite and PostgreSQL both support it; elsewhere the queue falls back to a scan.
+PARTIAL_INDEX_VENDORS = ('sqlite', 'postgresql')
+
+
+def create_unreviewed_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute(
+            'CREATE INDEX book_unreviewed_idx ON catalog_book (id) WHERE date_reviewed IS NULL')
+
+
+def drop_unreviewed_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute('DROP INDEX IF EXISTS book_unreviewed_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0002_dashboardcounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['last_name', 'first_name', 'id'], name='author_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'id'], name='book_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='readedbook',
+            index=models.Index(fields=['status', 'due_back', 'id'], name='readedbook_status_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='readedbook',
+            index=models.Index(fields=['borrower', 'status', 'due_back'], name='readedbook_borrower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='readedbook',
+            index=models.Index(fields=['due_back', 'id'], name='readedbook_due_back_idx'),
+        ),
+        migrations.RunPython(create_unreviewed_index, drop_unreviewed_index),
+    ]
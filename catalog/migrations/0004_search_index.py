@@ -0,0 +1,45 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.utils import OperationalError
+
+
+def create_fts_table(apps, schema_editor):
+    # Without FTS5 (or off SQLite) catalog.search falls back to the SearchTerm table.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE catalog_book_fts USING fts5(title, author, catagory, review)')
+    except OperationalError:
+        pass
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS catalog_book_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0003_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=50)),
+                ('weight', models.PositiveSmallIntegerField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='catalog.Book')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['term', 'book', 'weight'], name='searchterm_term_idx'),
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:41
+
+import catalog.indexes
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def drop_sql_unreviewed_index(apps, schema_editor):
+    # 0003 created this index with plain SQL, which SQLite loses whenever it rebuilds
+    # the table; it is recreated below as a model index so Django keeps track of it.
+    schema_editor.execute('DROP INDEX IF EXISTS book_unreviewed_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_sql_unreviewed_index, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='author',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='readedbook',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=catalog.indexes.PartialIndex(fields=['id'], name='book_unreviewed_idx', where='date_reviewed IS NULL'),
+        ),
+    ]
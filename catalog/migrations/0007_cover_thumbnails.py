@@ -0,0 +1,32 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0006_outbound_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoverThumbnailJob',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='catalog.Book')),
+                ('queued_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='cover_detail',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='cover_list',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_cover_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='readedbook',
+            name='reminded_on',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+    ]
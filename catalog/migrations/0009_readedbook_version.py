@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_overdue_reminders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='readedbook',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
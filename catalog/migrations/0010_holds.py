@@ -0,0 +1,40 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:46
+
+import catalog.indexes
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0009_readedbook_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hold',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('assigned_at', models.DateTimeField(blank=True, null=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='catalog.Book')),
+                ('copy', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='hold', to='catalog.ReadedBook')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='hold',
+            index=catalog.indexes.PartialIndex(fields=['book', 'created_at', 'id'], name='hold_queue_idx', where='assigned_at IS NULL'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='hold',
+            unique_together={('book', 'user')},
+        ),
+    ]
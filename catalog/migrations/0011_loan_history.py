@@ -0,0 +1,99 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0010_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorLoanDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('loans', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BookLoanDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('loans', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CatagoryLoanDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('catagory', models.CharField(choices=[('Science book', 'Science books'), ('English book', 'English books'), ('Biology book', 'Biology books')], max_length=200)),
+                ('day', models.DateField()),
+                ('loans', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LoanEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('checkout', 'Checked out'), ('renew', 'Renewed'), ('return', 'Returned')], max_length=10)),
+                ('due_back', models.DateField(null=True)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('book', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='loan_events', to='catalog.Book')),
+                ('borrower', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='loan_events', to=settings.AUTH_USER_MODEL)),
+                ('copy', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='loan_events', to='catalog.ReadedBook')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_event_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='catagoryloanday',
+            index=models.Index(fields=['day', 'catagory'], name='catagoryloanday_day_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='catagoryloanday',
+            unique_together={('catagory', 'day')},
+        ),
+        migrations.AddField(
+            model_name='bookloanday',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='loan_days', to='catalog.Book'),
+        ),
+        migrations.AddField(
+            model_name='authorloanday',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='loan_days', to='catalog.Author'),
+        ),
+        migrations.AddIndex(
+            model_name='bookloanday',
+            index=models.Index(fields=['day', 'book'], name='bookloanday_day_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bookloanday',
+            unique_together={('book', 'day')},
+        ),
+        migrations.AddIndex(
+            model_name='authorloanday',
+            index=models.Index(fields=['day', 'author'], name='authorloanday_day_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='authorloanday',
+            unique_together={('author', 'day')},
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:52
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_copies(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    ReadedBook = apps.get_model('catalog', 'ReadedBook')
+
+    def copies(**filters):
+        counted = (ReadedBook.objects.filter(book=OuterRef('pk'), **filters).order_by()
+                   .values('book').annotate(n=Count('pk')).values('n'))
+        return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+    Book.objects.update(copies_total=copies(), copies_available=copies(status='a'),
+                        copies_on_loan=copies(status='o'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_loan_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='copies_available',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_on_loan',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-copies_available', 'title', 'id'], name='book_available_idx'),
+        ),
+        migrations.RunPython(count_copies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0012_book_copy_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['catagory', 'title', 'id'], name='book_catagory_idx'),
+        ),
+    ]
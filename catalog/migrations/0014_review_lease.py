@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0013_book_catagory_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='review_lease_expires',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 2.1.5 on 2026-10-18 13:05
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def name_key(name):
+    # A copy of catalog.models.name_key as of this migration, so later changes to it don't alter history.
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    return ' '.join(''.join(c for c in decomposed if not unicodedata.combining(c)).casefold().split())
+
+
+def fill_name_keys(apps, schema_editor):
+    Author = apps.get_model('catalog', 'Author')
+    last = 0
+    while True:
+        batch = list(Author.objects.filter(pk__gt=last).order_by('pk')
+                     .values_list('pk', 'first_name', 'last_name')[:1000])
+        if not batch:
+            return
+        for pk, first_name, last_name in batch:
+            Author.objects.filter(pk=pk).update(first_name_key=name_key(first_name)[:100],
+                                                last_name_key=name_key(last_name)[:100])
+        last = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0014_review_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='first_name_key',
+            field=models.CharField(default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='author',
+            name='last_name_key',
+            field=models.CharField(default='', editable=False, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['last_name_key', 'first_name_key', 'id'], name='author_last_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['first_name_key', 'last_name_key', 'id'], name='author_first_key_idx'),
+        ),
+        migrations.RunPython(fill_name_keys, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,11 @@
 from __future__ import unicode_literals
 
-from django.db.models.signals import post_save
+import unicodedata
+
+from django.db.models.signals import post_init, post_save
 from django.dispatch import receiver
 
+from django.core.files.storage import default_storage
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils.timezone import now
@@ -10,6 +13,8 @@ from django.contrib.auth.models import AbstractUser
 
 from django.urls import reverse  # To generate URLS by reversing URL patterns
 
+from .indexes import PartialIndex
+
 
 class Book(models.Model):
 
@@ -28,14 +33,66 @@ class Book(models.Model):
     review = models.TextField(blank=True, null=True)
     reviewed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='reviews')
     date_reviewed = models.DateTimeField(blank=True,null=True)
+    # Until when reviewed_by has the book claimed for review (see catalog.reviews).
+    review_lease_expires = models.DateTimeField(null=True, blank=True, editable=False)
     is_favourite = models.BooleanField(default=False, verbose_name="Favourite?")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Storage names of the resized covers, filled in by catalog.covers.
+    cover_list = models.CharField(max_length=255, blank=True, editable=False)
+    cover_detail = models.CharField(max_length=255, blank=True, editable=False)
+    # Copies of the book by status, kept up to date by catalog.availability.
+    copies_total = models.PositiveIntegerField(default=0, editable=False)
+    copies_available = models.PositiveIntegerField(default=0, editable=False)
+    copies_on_loan = models.PositiveIntegerField(default=0, editable=False)
+
+    COPY_COUNTERS = ('copies_total', 'copies_available', 'copies_on_loan')
+    # Written only by the thumbnail worker (and cleared by catalog.covers on a new cover).
+    COVER_THUMBNAILS = ('cover_list', 'cover_detail')
 
     def display_catagory(self):
         """Creates a string for the Catagory. This is required to display catagory in Admin."""
-        return ', '.join([catagory.name for catagory in self.catagory.all()[:3]])
+        return self.get_catagory_display()
 
     display_catagory.short_description = 'Catagory'
 
+    def _cover_url(self, name):
+        if name:
+            return default_storage.url(name)
+        # Not resized yet: fall back to the original upload.
+        return self.cover.url if self.cover else None
+
+    @property
+    def cover_list_url(self):
+        """URL of the cover at the size shown in book lists."""
+        return self._cover_url(self.cover_list)
+
+    @property
+    def cover_detail_url(self):
+        """URL of the cover at the size shown on the book page."""
+        return self._cover_url(self.cover_detail)
+
+    class Meta:
+        indexes = [
+            # Book list, paged on title (see BookListView).
+            models.Index(fields=['title', 'id'], name='book_title_idx'),
+            # The pending-review queue (ReviewList).
+            PartialIndex(fields=['id'], name='book_unreviewed_idx', where='date_reviewed IS NULL'),
+            # Book list sorted by availability.
+            models.Index(fields=['-copies_available', 'title', 'id'], name='book_available_idx'),
+            # Book list filtered by catagory, and the catagory facet counts.
+            models.Index(fields=['catagory', 'title', 'id'], name='book_catagory_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # The copy counters only change by increments in the database, and the thumbnails
+        # only by the worker; writing back the values this instance happened to load
+        # would undo their changes.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            skipped = self.COPY_COUNTERS + self.COVER_THUMBNAILS
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in skipped]
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         """Returns the url to access a particular readed book."""
         return reverse('book-detail', args=[str(self.id)])
@@ -50,12 +107,28 @@ from datetime import date
 from django.contrib.auth.models import User  # Required to assign User as a borrower
 
 
+class ReadedBookQuerySet(models.QuerySet):
+
+    def on_loan(self):
+        return self.filter(status__exact='o')
+
+    def overdue(self, today=None):
+        """Copies on loan past their due date, found with readedbook_status_due_idx."""
+        return self.on_loan().filter(due_back__lt=today or date.today())
+
+
 class ReadedBook(models.Model):
     """Model representing a specific copy of a book (i.e. that can be borrowed and read from the from the books Catalog Application)."""
     book = models.ForeignKey('Book', on_delete=models.SET_NULL, null=True)
     imprint = models.CharField(max_length=200)
     due_back = models.DateField(null=True, blank=True)
     borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # When the borrower was last sent an overdue reminder (see catalog.overdue).
+    reminded_on = models.DateField(null=True, blank=True, editable=False)
+    # Bumped on every change, so an edit based on a stale copy can be refused (see catalog.loans).
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = ReadedBookQuerySet.as_manager()
 
     @property
     def is_overdue(self):
@@ -76,10 +149,32 @@ class ReadedBook(models.Model):
         blank=True,
         default='d',
         help_text='Book availability')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['due_back']
         permissions = (("can_mark_returned", "Set book as returned"),)
+        indexes = [
+            # Copies by status in due date order: loans list, available count.
+            models.Index(fields=['status', 'due_back', 'id'], name='readedbook_status_due_idx'),
+            # A borrower's loans (LoanedBooksByUserListView).
+            models.Index(fields=['borrower', 'status', 'due_back'], name='readedbook_borrower_idx'),
+            # Default ordering, used by the paged copies list.
+            models.Index(fields=['due_back', 'id'], name='readedbook_due_back_idx'),
+        ]
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        # The receivers that note a copy's state as loaded (catalog.stats,
+        # availability, ...) must see the refreshed state, not the old one.
+        post_init.send(sender=type(self), instance=self)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'version'}
+        super().save(*args, **kwargs)
 
     def get_absolute_url(self):
         """Returns the url to access a particular author instance."""
@@ -90,15 +185,43 @@ class ReadedBook(models.Model):
         return '{0} ({1})'.format(self.id, self.book.title)
 
 
+def name_key(name):
+    """A name folded for prefix matching: no accents, no case, single spaces."""
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    return ' '.join(''.join(c for c in decomposed if not unicodedata.combining(c)).casefold().split())
+
+
 class Author(models.Model):
     """Model representing an author."""
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     date_of_birth = models.DateField(null=True, blank=True)
     date_of_death = models.DateField('died', null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # name_key() of each name, for the author autocomplete (see catalog.autocomplete).
+    first_name_key = models.CharField(max_length=100, editable=False, default='')
+    last_name_key = models.CharField(max_length=100, editable=False, default='')
 
     class Meta:
         ordering = ['last_name', 'first_name']
+        indexes = [
+            models.Index(fields=['last_name', 'first_name', 'id'], name='author_name_idx'),
+            # Author autocomplete: prefix ranges on either name.
+            models.Index(fields=['last_name_key', 'first_name_key', 'id'], name='author_last_key_idx'),
+            models.Index(fields=['first_name_key', 'last_name_key', 'id'], name='author_first_key_idx'),
+        ]
+
+    def fill_name_keys(self):
+        """Set the name keys from the names; bulk_create callers must call it themselves."""
+        self.first_name_key = name_key(self.first_name)[:100]
+        self.last_name_key = name_key(self.last_name)[:100]
+        return self
+
+    def save(self, *args, **kwargs):
+        self.fill_name_keys()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'first_name_key', 'last_name_key'}
+        super().save(*args, **kwargs)
 
     def get_absolute_url(self):
         """Returns the url to access a particular author instance."""
@@ -109,6 +232,143 @@ class Author(models.Model):
         return '{0}, {1}'.format(self.last_name, self.first_name)
 
 
+class DashboardCounter(models.Model):
+    """Running total for one of the home page statistics (see catalog.stats)."""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        """String for representing the Model object."""
+        return '{0}={1}'.format(self.name, self.value)
+
+
+class SearchTerm(models.Model):
+    """One word of a book's search entry, used where the database has no full-text index (see catalog.search)."""
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='search_terms')
+    # db_index also gives PostgreSQL the pattern_ops index its LIKE 'term%' lookups need.
+    term = models.CharField(max_length=50, db_index=True)
+    weight = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            # Prefix lookups on term, grouped by book, without touching the table.
+            models.Index(fields=['term', 'book', 'weight'], name='searchterm_term_idx'),
+        ]
+
+
+class OutboundEmail(models.Model):
+    """An email waiting in the outbox for the send_queued_email worker (see catalog.outbox)."""
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.TextField(help_text='Comma-separated recipient addresses')
+    created_at = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField(default=now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's "what is due" query only ever looks at unsent mail.
+            PartialIndex(fields=['send_after', 'id'], name='outboundemail_due_idx', where='sent_at IS NULL'),
+        ]
+
+    def __str__(self):
+        """String for representing the Model object."""
+        return '{0} -> {1}'.format(self.subject, self.to)
+
+
+class CoverThumbnailJob(models.Model):
+    """A book whose cover needs resizing by the process_cover_thumbnails worker (see catalog.covers)."""
+    book = models.OneToOneField('Book', on_delete=models.CASCADE, primary_key=True)
+    queued_at = models.DateTimeField(default=now, db_index=True)
+
+
+class Hold(models.Model):
+    """A reader's place in the queue for the next copy of a book (see catalog.holds)."""
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='holds')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='holds')
+    created_at = models.DateTimeField(default=now, editable=False)
+    # Both set once a returned copy has been put aside for this hold; waiting holds have neither.
+    copy = models.OneToOneField('ReadedBook', on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='hold')
+    assigned_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        unique_together = ('book', 'user')
+        indexes = [
+            # The waiting holds of a book in queue order: the next hold is one index seek.
+            # (Filtering on copy_id instead leads SQLite to the unique index on it.)
+            PartialIndex(fields=['book', 'created_at', 'id'], name='hold_queue_idx',
+                         where='assigned_at IS NULL'),
+        ]
+
+    def __str__(self):
+        return '{0} for {1}'.format(self.book, self.user)
+
+
+class LoanEvent(models.Model):
+    """One entry in the append-only circulation history (see catalog.circulation)."""
+    CHECKOUT, RENEW, RETURN = 'checkout', 'renew', 'return'
+    KINDS = (
+        (CHECKOUT, 'Checked out'),
+        (RENEW, 'Renewed'),
+        (RETURN, 'Returned'),
+    )
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    copy = models.ForeignKey('ReadedBook', on_delete=models.SET_NULL, null=True, related_name='loan_events')
+    # The book and borrower at the time, kept even if the copy is later deleted or lent to someone else.
+    book = models.ForeignKey('Book', on_delete=models.SET_NULL, null=True, related_name='loan_events')
+    borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='loan_events')
+    due_back = models.DateField(null=True)
+    created_at = models.DateTimeField(default=now, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+
+
+class RollupCheckpoint(models.Model):
+    """How far through the loan events the rollup job has got."""
+    name = models.CharField(max_length=50, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+
+
+class BookLoanDay(models.Model):
+    """Checkouts of one book on one day, summed from LoanEvent by the rollup job."""
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='loan_days')
+    day = models.DateField()
+    loans = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('book', 'day')
+        indexes = [models.Index(fields=['day', 'book'], name='bookloanday_day_idx')]
+
+
+class AuthorLoanDay(models.Model):
+    """Checkouts of one author's books on one day."""
+    author = models.ForeignKey('Author', on_delete=models.CASCADE, related_name='loan_days')
+    day = models.DateField()
+    loans = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('author', 'day')
+        indexes = [models.Index(fields=['day', 'author'], name='authorloanday_day_idx')]
+
+
+class CatagoryLoanDay(models.Model):
+    """Checkouts of the books in one catagory on one day."""
+    catagory = models.CharField(max_length=200, choices=Book.CATAGORY_CHOICES)
+    day = models.DateField()
+    loans = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('catagory', 'day')
+        indexes = [models.Index(fields=['day', 'catagory'], name='catagoryloanday_day_idx')]
+
+
 class User(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(max_length=500, blank=True)
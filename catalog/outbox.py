@@ -0,0 +1,119 @@
+"""
+Outbound email queue.
+
+Views put messages in the OutboundEmail table instead of talking to the mail
+server, so a slow SMTP server never holds up a request. The send_queued_email
+command drains the table in batches over one mail connection per batch and
+retries failed messages with exponential backoff.
+
+A batch is claimed first, in a short transaction of its own: its send_after
+is pushed CATALOG_EMAIL_LEASE_SECONDS ahead, so no other worker takes it. The
+messages are then sent outside any transaction, and each result is written
+as soon as it is known. No lock is held while talking to the mail server,
+and a worker that dies mid-batch leaves its unsent messages to be picked up
+again when the lease runs out; only a message it had sent but not yet
+recorded goes out twice.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+
+def max_attempts():
+    return getattr(settings, 'CATALOG_EMAIL_MAX_ATTEMPTS', 5)
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next try: 1, 2, 4, 8... minutes, at most an hour."""
+    base = getattr(settings, 'CATALOG_EMAIL_RETRY_SECONDS', 60)
+    return min(base * 2 ** (attempts - 1), 3600)
+
+
+def queue_email(subject, body, to, from_email=None):
+    """Put a message in the outbox; returns the OutboundEmail."""
+    return OutboundEmail.objects.create(
+        subject=subject, body=body, to=','.join(to), from_email=from_email or '')
+
+
+def lease_time():
+    return datetime.timedelta(seconds=getattr(settings, 'CATALOG_EMAIL_LEASE_SECONDS', 600))
+
+
+def due_messages(batch_size, now):
+    queryset = (OutboundEmail.objects
+                .filter(sent_at__isnull=True, send_after__lte=now, attempts__lt=max_attempts())
+                .order_by('send_after', 'id'))
+    if connection.features.has_select_for_update_skip_locked:
+        # Several workers can run at once, each taking different rows.
+        queryset = queryset.select_for_update(skip_locked=True)
+    return list(queryset.values_list('pk', flat=True)[:batch_size])
+
+
+def claim(batch_size):
+    """Lease the next due messages to this worker; returns them, maybe fewer under contention."""
+    now = timezone.now()
+    leased_until = now + lease_time()
+    with transaction.atomic():
+        candidates = due_messages(batch_size, now)
+        if not candidates:
+            return []
+        # Conditional on still being due: a message another worker took in the meantime is skipped.
+        OutboundEmail.objects.filter(pk__in=candidates, sent_at__isnull=True, send_after__lte=now).update(
+            send_after=leased_until)
+    return list(OutboundEmail.objects.filter(pk__in=candidates, sent_at__isnull=True, send_after=leased_until)
+                .order_by('id'))
+
+
+def record_sent(message):
+    message.attempts += 1
+    message.sent_at = timezone.now()
+    message.save(update_fields=['attempts', 'sent_at'])
+
+
+def record_failure(message, exc):
+    """Note the error and put the message back in the queue after its backoff."""
+    message.attempts += 1
+    message.last_error = '{0}: {1}'.format(type(exc).__name__, exc)
+    message.send_after = timezone.now() + datetime.timedelta(seconds=retry_delay(message.attempts))
+    message.save(update_fields=['attempts', 'last_error', 'send_after'])
+
+
+def send_queued(batch_size=100):
+    """
+    Send one batch of due messages over a single mail connection.
+
+    Returns (sent, failed). Messages that fail, including the whole batch
+    when the mail server can't be reached, are tried again later, until
+    CATALOG_EMAIL_MAX_ATTEMPTS is reached.
+    """
+    messages = claim(batch_size)
+    if not messages:
+        return 0, 0
+    mail_connection = get_connection()
+    try:
+        mail_connection.open()
+    except Exception as exc:
+        for message in messages:
+            record_failure(message, exc)
+        return 0, len(messages)
+    sent = failed = 0
+    try:
+        for message in messages:
+            email = EmailMessage(message.subject, message.body, message.from_email or None,
+                                 message.to.split(','), connection=mail_connection)
+            try:
+                mail_connection.send_messages([email])
+            except Exception as exc:
+                record_failure(message, exc)
+                failed += 1
+            else:
+                record_sent(message)
+                sent += 1
+    finally:
+        mail_connection.close()
+    return sent, failed
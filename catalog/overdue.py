@@ -0,0 +1,76 @@
+"""
+Reminders for overdue loans.
+
+The send_overdue_reminders command runs this once a day or so. It walks the
+overdue copies in batches, straight off readedbook_status_due_idx, and for
+each batch queues the reminder emails in the outbox and stamps the copies'
+reminded_on in one transaction, so a stopped sweep picks up where it left
+off and nobody is reminded twice within CATALOG_OVERDUE_REMINDER_DAYS.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .caching import bump_version
+from .models import OutboundEmail, ReadedBook
+
+
+def reminder_interval():
+    return datetime.timedelta(days=getattr(settings, 'CATALOG_OVERDUE_REMINDER_DAYS', 7))
+
+
+def due_reminders(today=None):
+    """Overdue copies whose borrower has an email address and hasn't been reminded lately."""
+    today = today or datetime.date.today()
+    return (ReadedBook.objects.overdue(today)
+            .filter(Q(reminded_on__isnull=True) | Q(reminded_on__lte=today - reminder_interval()))
+            .exclude(borrower__email='')
+            .filter(borrower__isnull=False))
+
+
+def remind_batch(batch_size, today=None, after=None):
+    """
+    Queue reminders for the next batch of overdue copies.
+
+    Returns (number queued, the (due_back, id) of the last copy), to pass back
+    as after= so the next batch seeks past this one instead of rescanning it.
+    """
+    today = today or datetime.date.today()
+    queryset = due_reminders(today)
+    if after:
+        queryset = queryset.filter(Q(due_back__gt=after[0]) | Q(due_back=after[0], id__gt=after[1]))
+    with transaction.atomic():
+        rows = list(queryset.order_by('due_back', 'id').values_list(
+            'id', 'due_back', 'book__title', 'borrower__username', 'borrower__email')[:batch_size])
+        if not rows:
+            return 0, after
+        OutboundEmail.objects.bulk_create([
+            OutboundEmail(
+                subject='Overdue: {0}'.format(title or 'a library book'),
+                body=render_to_string('catalog/email/overdue_reminder.txt', {
+                    'username': username, 'title': title, 'due_back': due_back,
+                    'days_late': (today - due_back).days,
+                }),
+                to=email,
+            )
+            for copy_id, due_back, title, username, email in rows
+        ])
+        ReadedBook.objects.filter(pk__in=[row[0] for row in rows]).update(
+            reminded_on=today, updated_at=timezone.now())
+    bump_version(ReadedBook)
+    return len(rows), (rows[-1][1], rows[-1][0])
+
+
+def remind_overdue(batch_size=500, today=None):
+    """Queue reminders for every copy that's due one; returns how many were queued."""
+    total = 0
+    after = None
+    while True:
+        queued, after = remind_batch(batch_size, today, after)
+        total += queued
+        if queued < batch_size:
+            return total
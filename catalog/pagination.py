@@ -0,0 +1,195 @@
+"""
+Keyset (cursor) pagination for the generic ListViews.
+
+Instead of OFFSET/LIMIT plus a COUNT(*), each page seeks past the ordering key
+of the last row it showed, so the cost of a page doesn't depend on how deep it
+is. The ordering comes from the model's Meta.ordering with 'id' appended as a
+tie-breaker; NULLs sort first on ascending keys and last on descending ones,
+the same on every database.
+
+The admin can't use cursors, so it gets EstimatedCountPaginator, which at
+least skips the COUNT(*) over the whole table.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (TypeError, ValueError):
+        raise Http404('Invalid cursor.')
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        raise Http404('Invalid cursor.')
+    return direction, values
+
+
+class CursorPage:
+    """The slice of a queryset shown on one page, as used by base_generic.html."""
+    is_cursor_page = True
+
+    def __init__(self, object_list, next_query=None, previous_query=None):
+        self.object_list = object_list
+        self.next_query = next_query
+        self.previous_query = previous_query
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_query is not None
+
+    def has_previous(self):
+        return self.previous_query is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginationMixin:
+    """
+    Replaces ListView's page-number pagination with keyset pagination.
+
+    Pages are selected with ?cursor=<token>; the tokens for the neighbouring
+    pages are available as page_obj.next_query and page_obj.previous_query.
+    """
+    cursor_ordering = None
+    cursor_kwarg = 'cursor'
+
+    def get_cursor_ordering(self):
+        ordering = list(self.cursor_ordering or self.model._meta.ordering)
+        if not any(key.lstrip('-') in ('id', 'pk') for key in ordering):
+            ordering.append('id')
+        return ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        keys = [(key.lstrip('-'), key.startswith('-')) for key in self.get_cursor_ordering()]
+        fields = [self.model._meta.get_field(name) for name, _ in keys]
+
+        token = self.request.GET.get(self.cursor_kwarg)
+        direction, values = decode_cursor(token) if token else ('next', None)
+        backwards = direction == 'prev'
+        if values is not None:
+            if len(values) != len(keys):
+                raise Http404('Invalid cursor.')
+            try:
+                values = [None if v is None else field.to_python(v) for field, v in zip(fields, values)]
+            except Exception:
+                raise Http404('Invalid cursor.')
+            queryset = queryset.filter(self._seek(keys, values, backwards))
+
+        queryset = self.order_for_paging(queryset, backwards)
+        rows = list(queryset[:page_size + 1])
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        if backwards:
+            rows.reverse()
+
+        has_next = more if not backwards else True
+        has_previous = token is not None if not backwards else more
+        page = CursorPage(
+            rows,
+            next_query=self._query('next', rows[-1], fields) if rows and has_next else None,
+            previous_query=self._query('prev', rows[0], fields) if rows and has_previous else None,
+        )
+        return None, page, rows, page.has_other_pages()
+
+    def order_for_paging(self, queryset, backwards=False):
+        """Order the queryset by the cursor keys, in reverse for a previous page."""
+        # SQLite and MySQL already sort NULLs first ascending and last descending.
+        # Spelling that out makes SQLite sort with a temporary b-tree instead of
+        # walking the index, so only ask for it where the default differs.
+        native = connections[queryset.db].vendor in ('sqlite', 'mysql')
+        order = []
+        for key in self.get_cursor_ordering():
+            name, descending = key.lstrip('-'), key.startswith('-')
+            explicit = self.model._meta.get_field(name).null and not native
+            if descending != backwards:
+                order.append(F(name).desc(nulls_last=explicit))
+            else:
+                order.append(F(name).asc(nulls_first=explicit))
+        return queryset.order_by(*order)
+
+    def _seek(self, keys, values, backwards):
+        """Q for rows strictly after (or before) the given key values in the page ordering."""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for (name, descending), value in zip(keys, values):
+            if descending != backwards:
+                # Descending, NULLs last: everything smaller, then the NULLs.
+                if value is None:
+                    after = Q(pk__in=[])
+                else:
+                    after = Q(**{name + '__lt': value}) | Q(**{name + '__isnull': True})
+            else:
+                # Ascending, NULLs first: past the NULLs, everything bigger.
+                after = Q(**{name + '__isnull': False}) if value is None else Q(**{name + '__gt': value})
+            condition |= equal & after
+            equal &= Q(**{name + '__isnull': True}) if value is None else Q(**{name: value})
+        return condition
+
+    def _query(self, direction, obj, fields):
+        values = [field.value_to_string(obj) if getattr(obj, field.attname) is not None else None
+                  for field in fields]
+        params = self.request.GET.copy()
+        params[self.cursor_kwarg] = encode_cursor(direction, values)
+        params.pop('page', None)
+        return params.urlencode()
+
+
+def estimate_rows(model, using='default'):
+    """
+    The database's own idea of how many rows a table has, or None.
+
+    Read from the planner statistics (PostgreSQL, MySQL) or, on SQLite, the
+    highest rowid: cheap on any size of table, but only roughly right.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    queries = {
+        'postgresql': ('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table]),
+        'mysql': ('SELECT table_rows FROM information_schema.tables '
+                  'WHERE table_schema = DATABASE() AND table_name = %s', [table]),
+        'sqlite': ('SELECT MAX(rowid) FROM {0}'.format(connection.ops.quote_name(table)), []),
+    }
+    if connection.vendor not in queries:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(*queries[connection.vendor])
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A Paginator that doesn't COUNT(*) a whole big table.
+
+    For an unfiltered queryset it takes estimate_rows() instead, once that is
+    over CATALOG_EXACT_COUNT_LIMIT rows; smaller tables and filtered querysets
+    are counted exactly. Used by the admin (see catalog.admin).
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = estimate_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > getattr(settings, 'CATALOG_EXACT_COUNT_LIMIT', 100000):
+                return estimate
+        return super().count
@@ -0,0 +1,113 @@
+"""
+The review queue: books waiting for a review, handed out to reviewers under a lease.
+
+A reviewer claims the next few unreviewed books at once. The claim sets
+reviewed_by and review_lease_expires with one conditional UPDATE that only
+matches books nobody holds a live lease on, so two reviewers claiming at the
+same moment never get the same book; each gets whatever its own UPDATE
+matched. A lease that runs out (a reviewer who wandered off) simply puts the
+book back in the queue. Books assigned by hand through the review list have
+a reviewer but no lease and stay with that reviewer.
+
+Submitting a review claims the book in the same way, if it isn't claimed by
+the reviewer already, and stamps date_reviewed, which takes the book out of
+the queue for good. The queue is read in id order off book_unreviewed_idx, a
+partial index over the unreviewed books only.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .caching import bump_version
+from .models import Book
+
+# Most books one claim may take.
+MAX_CLAIM = 50
+
+
+class ReviewConflict(Exception):
+    """The book can't be reviewed by this reviewer now; the message says why."""
+
+
+def lease_time():
+    return datetime.timedelta(minutes=getattr(settings, 'CATALOG_REVIEW_LEASE_MINUTES', 30))
+
+
+def pending():
+    """Books waiting for a review, in queue order."""
+    return Book.objects.filter(date_reviewed__isnull=True).order_by('id')
+
+
+def claimable(now=None):
+    """Q for pending books nobody is reviewing: unassigned, or their lease has run out."""
+    now = now or timezone.now()
+    return Q(reviewed_by__isnull=True) | Q(review_lease_expires__lt=now)
+
+
+def claimed_by(user, now=None):
+    """The books user holds a live lease on."""
+    now = now or timezone.now()
+    return pending().filter(reviewed_by=user, review_lease_expires__gte=now)
+
+
+def claim_next(user, n=10):
+    """Lease the next n unclaimed books to user; returns the books claimed, maybe fewer under contention."""
+    now = timezone.now()
+    expires = now + lease_time()
+    with transaction.atomic():
+        candidates = list(pending().filter(claimable(now)).values_list('pk', flat=True)[:min(n, MAX_CLAIM)])
+        if not candidates:
+            return []
+        # Conditional on still being claimable: a book another reviewer took in
+        # the meantime is skipped, not taken over.
+        Book.objects.filter(pk__in=candidates, date_reviewed__isnull=True).filter(claimable(now)).update(
+            reviewed_by=user, review_lease_expires=expires, updated_at=now)
+        claimed = list(Book.objects.filter(pk__in=candidates, reviewed_by=user, review_lease_expires=expires)
+                       .select_related('author').order_by('id'))
+    if claimed:
+        bump_version(Book)
+    return claimed
+
+
+def release(user, pk):
+    """Give up a claim on one book, putting it back in the queue."""
+    released = Book.objects.filter(pk=pk, reviewed_by=user, date_reviewed__isnull=True,
+                                   review_lease_expires__isnull=False).update(
+        reviewed_by=None, review_lease_expires=None, updated_at=timezone.now())
+    if released:
+        bump_version(Book)
+    return bool(released)
+
+
+def complete_review(pk, user, review, is_favourite):
+    """Save user's review of a book and take it out of the queue; returns the book."""
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = (Book.objects.filter(pk=pk, date_reviewed__isnull=True)
+                   .filter(claimable(now) | Q(reviewed_by=user))
+                   .update(reviewed_by=user, review_lease_expires=now + lease_time(), updated_at=now))
+        if not claimed:
+            raise _conflict(pk, now)
+        book = Book.objects.get(pk=pk)
+        book.review = review
+        book.is_favourite = is_favourite
+        book.date_reviewed = now
+        book.review_lease_expires = None
+        book.save()
+    return book
+
+
+def _conflict(pk, now):
+    book = Book.objects.select_related('reviewed_by').filter(pk=pk).first()
+    if book is None:
+        return ReviewConflict('This book has been deleted.')
+    if book.date_reviewed is not None:
+        return ReviewConflict('This book has already been reviewed.')
+    reviewer = book.reviewed_by.get_full_name() or book.reviewed_by.username
+    if book.review_lease_expires is None:
+        return ReviewConflict('This book is assigned to {0}.'.format(reviewer))
+    return ReviewConflict('{0} is reviewing this book until {1:%H:%M}.'.format(
+        reviewer, timezone.localtime(book.review_lease_expires)))
@@ -0,0 +1,160 @@
+"""
+Ranked catalog search over book titles, reviews, categories and author names.
+
+Every book has a denormalized entry in a search table that the signal
+receivers below keep current. On SQLite the entries live in an FTS5 virtual
+table (catalog_book_fts, keyed by the book id) and are ranked with bm25. On
+other databases, or a SQLite build without FTS5, they are stored as weighted
+terms in SearchTerm and matched by indexed prefix lookups, never LIKE '%...%'.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Author, Book, SearchTerm
+
+FTS_TABLE = 'catalog_book_fts'
+
+# Relative importance of each part of a book, highest first.
+WEIGHTS = {'title': 10, 'author': 5, 'catagory': 2, 'review': 1}
+
+MAX_RESULTS = 50
+MAX_QUERY_TERMS = 8
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+_fts_available = {}
+
+
+def tokenize(text):
+    max_length = SearchTerm._meta.get_field('term').max_length
+    return [token[:max_length] for token in TOKEN.findall((text or '').lower())]
+
+
+def uses_fts():
+    """True if this database has the FTS5 table (created by migration 0004 on SQLite)."""
+    alias = connection.alias
+    if alias not in _fts_available:
+        _fts_available[alias] = (connection.vendor == 'sqlite'
+                                 and FTS_TABLE in connection.introspection.table_names())
+    return _fts_available[alias]
+
+
+def book_document(book):
+    """The text of each searchable part of a book."""
+    author = book.author
+    # In the same order as WEIGHTS and the FTS table's columns.
+    return {
+        'title': book.title,
+        'author': '{0} {1}'.format(author.first_name, author.last_name) if author else '',
+        'catagory': '{0} {1}'.format(book.catagory, book.get_catagory_display()),
+        'review': book.review or '',
+    }
+
+
+def index_books(books):
+    """Write (or rewrite) the search entries of the given books."""
+    books = list(books)
+    if not books:
+        return
+    ids = [book.pk for book in books]
+    with transaction.atomic():
+        if uses_fts():
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    'DELETE FROM {0} WHERE rowid = %s'.format(FTS_TABLE), [[pk] for pk in ids])
+                cursor.executemany(
+                    'INSERT INTO {0} (rowid, title, author, catagory, review) '
+                    'VALUES (%s, %s, %s, %s, %s)'.format(FTS_TABLE),
+                    [[book.pk] + list(book_document(book).values()) for book in books])
+        else:
+            SearchTerm.objects.filter(book_id__in=ids).delete()
+            terms = []
+            for book in books:
+                weights = {}
+                for part, text in book_document(book).items():
+                    for term in tokenize(text):
+                        weights[term] = max(weights.get(term, 0), WEIGHTS[part])
+                terms += [SearchTerm(book_id=book.pk, term=term, weight=weight)
+                          for term, weight in weights.items()]
+            SearchTerm.objects.bulk_create(terms)
+
+
+def unindex_books(ids):
+    if uses_fts():
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM {0} WHERE rowid = %s'.format(FTS_TABLE), [[pk] for pk in ids])
+    else:
+        SearchTerm.objects.filter(book_id__in=ids).delete()
+
+
+def search_ids(query, limit=MAX_RESULTS):
+    """Ids of the books matching every word of the query, best match first."""
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return []
+    if uses_fts():
+        weights = ', '.join('{0:.1f}'.format(w) for w in WEIGHTS.values())
+        match = ' '.join('"{0}"*'.format(term) for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM {0} WHERE {0} MATCH %s ORDER BY bm25({0}, {1}) LIMIT %s'.format(
+                    FTS_TABLE, weights),
+                [match, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+    matched = {'match_{0}'.format(i): Count('id', filter=Q(term__startswith=term))
+               for i, term in enumerate(terms)}
+    rows = (SearchTerm.objects
+            .filter(_any_prefix(terms))
+            .values('book_id')
+            .annotate(score=Sum('weight'), **matched)
+            .filter(**{name + '__gt': 0 for name in matched})
+            .order_by('-score', 'book_id')
+            .values_list('book_id', flat=True))
+    return list(rows[:limit])
+
+
+def _any_prefix(terms):
+    condition = Q()
+    for term in terms:
+        condition |= Q(term__startswith=term)
+    return condition
+
+
+def search_books(query, limit=MAX_RESULTS):
+    """The matching books, ranked, with their authors loaded."""
+    ids = search_ids(query, limit)
+    books = Book.objects.select_related('author').in_bulk(ids)
+    return [books[pk] for pk in ids if pk in books]
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_books([instance])
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    unindex_books([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        index_books(instance.book_set.select_related('author'))
+
+
+@receiver(pre_delete, sender=Author)
+def author_deleting(sender, instance, **kwargs):
+    # The books lose their author before post_delete runs, so note them now.
+    instance._search_book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, **kwargs):
+    index_books(Book.objects.filter(pk__in=getattr(instance, '_search_book_ids', [])))
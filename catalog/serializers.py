@@ -0,0 +1,46 @@
+from rest_framework import serializers
+
+from .models import Author, Book, ReadedBook
+
+
+class SparseFieldsMixin:
+    """Serializer that only renders the fields listed in ?fields=a,b,c, when given."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        wanted = request.query_params.get('fields') if request is not None else None
+        if wanted:
+            keep = set(name.strip() for name in wanted.split(','))
+            for name in set(self.fields) - keep:
+                self.fields.pop(name)
+
+
+class AuthorSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+
+    class Meta:
+        model = Author
+        fields = ('id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death', 'updated_at')
+
+
+class BookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Needs the author joined in (see BookViewSet.queryset).
+    author_name = serializers.StringRelatedField(source='author')
+    catagory_display = serializers.CharField(source='get_catagory_display')
+    cover_list_url = serializers.ReadOnlyField()
+    cover_detail_url = serializers.ReadOnlyField()
+
+    class Meta:
+        model = Book
+        fields = ('id', 'title', 'author', 'author_name', 'catagory', 'catagory_display', 'cover',
+                  'cover_list_url', 'cover_detail_url', 'review', 'is_favourite', 'date_reviewed',
+                  'copies_total', 'copies_available', 'copies_on_loan', 'updated_at')
+
+
+class ReadedBookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    status_display = serializers.CharField(source='get_status_display')
+
+    class Meta:
+        model = ReadedBook
+        # The borrower is left out: this API is public.
+        fields = ('id', 'book', 'imprint', 'status', 'status_display', 'due_back', 'updated_at')
@@ -0,0 +1,25 @@
+"""
+Removing expired sessions a batch at a time.
+
+Django's clearsessions deletes every expired row in one statement, which on
+a big table holds the write lock for as long as it takes. expire_sessions()
+walks django_session_expire_date_* instead, deleting batch_size rows per
+transaction, so logins and logouts carry on in between.
+"""
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.utils import timezone
+
+
+def expire_sessions(batch_size=1000, now=None):
+    """Delete the sessions that have expired; returns how many were deleted."""
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            keys = list(Session.objects.filter(expire_date__lt=now).order_by('expire_date')
+                        .values_list('session_key', flat=True)[:batch_size])
+            if not keys:
+                return deleted
+            Session.objects.filter(session_key__in=keys).delete()
+        deleted += len(keys)
@@ -0,0 +1,134 @@
+"""
+Dashboard counters for the catalog home page.
+
+The counts are worked out in a single aggregate query and cached with a TTL.
+Saving or deleting a Book, ReadedBook or Author drops the cached value. With
+CATALOG_STATS_USE_COUNTERS enabled the counts are kept in DashboardCounter
+rows instead, so the home page never scans the catalog tables.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .caching import bounded_timeout
+from .models import Author, Book, DashboardCounter, ReadedBook
+
+CACHE_KEY = 'catalog:dashboard-stats'
+
+STAT_NAMES = ('num_books', 'num_instances', 'num_instances_available', 'num_authors')
+
+
+def cache_timeout():
+    return bounded_timeout(getattr(settings, 'CATALOG_STATS_CACHE_TIMEOUT', 300))
+
+
+def use_counters():
+    return getattr(settings, 'CATALOG_STATS_USE_COUNTERS', False)
+
+
+def count_stats():
+    """Count every dashboard statistic in one round trip to the database."""
+    qn = connection.ops.quote_name
+    book_table = qn(Book._meta.db_table)
+    copy_table = qn(ReadedBook._meta.db_table)
+    author_table = qn(Author._meta.db_table)
+    sql = (
+        'SELECT '
+        '(SELECT COUNT(*) FROM {books}), '
+        '(SELECT COUNT(*) FROM {copies}), '
+        '(SELECT COUNT(*) FROM {copies} WHERE {status} = %s), '
+        '(SELECT COUNT(*) FROM {authors})'
+    ).format(books=book_table, copies=copy_table, authors=author_table, status=qn('status'))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, ['a'])
+        row = cursor.fetchone()
+    return dict(zip(STAT_NAMES, row))
+
+
+def rebuild_counters():
+    """Recount the catalog and overwrite the DashboardCounter rows."""
+    stats = count_stats()
+    with transaction.atomic():
+        for name, value in stats.items():
+            DashboardCounter.objects.update_or_create(name=name, defaults={'value': value})
+    cache.delete(CACHE_KEY)
+    return stats
+
+
+def read_counters():
+    stats = dict(DashboardCounter.objects.filter(name__in=STAT_NAMES).values_list('name', 'value'))
+    if len(stats) != len(STAT_NAMES):
+        # First use, or somebody cleared the table: seed it from a real count.
+        return rebuild_counters()
+    return stats
+
+
+def invalidate(recount=False):
+    """Drop the cached counters, recounting the counter rows too after changes that skipped signals."""
+    if recount and use_counters():
+        rebuild_counters()
+    cache.delete(CACHE_KEY)
+
+
+def get_dashboard_stats():
+    """Return the home page counters, from the cache when possible."""
+    stats = cache.get(CACHE_KEY)
+    if stats is None:
+        stats = read_counters() if use_counters() else count_stats()
+        cache.set(CACHE_KEY, stats, cache_timeout())
+    return stats
+
+
+def bump(deltas):
+    """Apply {name: delta} to the running counters."""
+    for name, delta in deltas.items():
+        if delta:
+            DashboardCounter.objects.filter(name=name).update(value=F('value') + delta)
+
+
+@receiver(post_init, sender=ReadedBook)
+def remember_copy_status(sender, instance, **kwargs):
+    # Keep the status as loaded so post_save can tell whether availability changed.
+    instance._stats_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+def object_saved(sender, instance, created, raw=False, **kwargs):
+    if created and use_counters() and not raw:
+        bump({'num_books' if sender is Book else 'num_authors': 1})
+    cache.delete(CACHE_KEY)
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+def object_deleted(sender, instance, **kwargs):
+    if use_counters():
+        bump({'num_books' if sender is Book else 'num_authors': -1})
+    cache.delete(CACHE_KEY)
+
+
+@receiver(post_save, sender=ReadedBook)
+def copy_saved(sender, instance, created, raw=False, **kwargs):
+    if use_counters() and not raw:
+        was_available = not created and getattr(instance, '_stats_status', None) == 'a'
+        is_available = instance.status == 'a'
+        bump({
+            'num_instances': 1 if created else 0,
+            'num_instances_available': int(is_available) - int(was_available),
+        })
+    instance._stats_status = instance.status
+    cache.delete(CACHE_KEY)
+
+
+@receiver(post_delete, sender=ReadedBook)
+def copy_deleted(sender, instance, **kwargs):
+    if use_counters():
+        bump({
+            'num_instances': -1,
+            'num_instances_available': -1 if getattr(instance, '_stats_status', None) == 'a' else 0,
+        })
+    cache.delete(CACHE_KEY)
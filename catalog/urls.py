@@ -5,7 +5,9 @@ from django.contrib.auth.decorators import login_required
 
 
 
-from . import views
+from rest_framework.routers import DefaultRouter
+
+from . import api, views
 
 
 urlpatterns = [
@@ -13,9 +15,14 @@ urlpatterns = [
     path('books/', views.BookListView.as_view(), name='books'),
     path('book/<int:pk>', views.BookDetailView.as_view(), name='book-detail'),
     path('authors/', views.AuthorListView.as_view(), name='authors'),
+    path('authors/autocomplete/', views.author_autocomplete, name='author-autocomplete'),
     path('author/<int:pk>', views.AuthorDetailView.as_view(), name='author-detail'),
 	path('readedbooks/', views.ReadedBookListView.as_view(), name='readedbooks'),
     path('readedbook/<int:pk>', views.ReadedBookDetailView.as_view(), name='readedbook-detail'),
+    path('search/', views.search, name='search'),
+    path('popular/', views.most_borrowed, name='most-borrowed'),
+    path('popular/trends/', views.loan_trends, name='loan-trends'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
 
 urlpatterns += [
@@ -23,13 +30,21 @@ urlpatterns += [
     path('readedbook/<int:pk>/update/', views.ReadedBookUpdate.as_view(), name='readedbook_update'),
     path('readedbook/<int:pk>/delete/', views.ReadedBookDelete.as_view(), name='readedbook_delete'),
     path('mybooks/', views.LoanedBooksByUserListView.as_view(), name='my-borrowed'),
+    path('myholds/', views.HoldsByUserListView.as_view(), name='my-holds'),
+    path('book/<int:pk>/hold/', views.place_hold, name='place-hold'),
+    path('hold/<int:pk>/cancel/', views.cancel_hold, name='cancel-hold'),
     path(r'borrowed/', views.LoanedBooksAllListView.as_view(), name='all-borrowed'),  # Added for challenge
+    path('borrowed/ledger.csv', views.loan_ledger_csv, name='loan-ledger-csv'),
+    path('borrowed/overdue/', views.OverdueBooksListView.as_view(), name='overdue-borrowed'),
 ]
 
 
-# Add URLConf for librarian to renew a book.
+# Add URLConf for librarian to renew, lend and take back books.
 urlpatterns += [
     path('book/<int:pk>/renew/', views.renew_book_librarian, name='renew-book-librarian'),
+    path('borrowed/bulk/', views.bulk_loans, name='bulk-loans'),
+    path('readedbook/<int:pk>/lend/', views.lend_copy, name='lend-copy'),
+    path('readedbook/<int:pk>/return/', views.return_copy, name='return-copy'),
 ]
 
 
@@ -52,7 +67,19 @@ urlpatterns += [
    path(r'^signup/$',  views.signup, name='signup'),
    path(r'^account_activation_sent/$', views.account_activation_sent, name='account_activation_sent'),
    path(r'^activate/(?P<uidb64>[0-9A-Za-z_\-]+)/(?P<token>[0-9A-Za-z]{1,13}-[0-9A-Za-z]{1,20})/$', views.activate, name='activate'),
-   path(r'^review/$', login_required(views.ReviewList.as_view()), name='review-books'),
-   path(r'^review/(?P<pk>[-\w]+)/$', views.review_book, name='review-book'),
+   path('review/', login_required(views.ReviewList.as_view()), name='review-books'),
+   path('review/claim/', views.claim_reviews, name='claim-reviews'),
+   path('review/<int:pk>/', views.review_book, name='review-book'),
+   path('review/<int:pk>/release/', views.release_review, name='release-review'),
 ]
 
+
+# Read-only REST API (see catalog.api).
+router = DefaultRouter()
+router.register('books', api.BookViewSet)
+router.register('authors', api.AuthorViewSet)
+router.register('readedbooks', api.ReadedBookViewSet)
+
+urlpatterns += [
+    path('api/', include((router.urls, 'api'))),
+]
@@ -1,85 +1,179 @@
+# Not plain settings: the settings view below would shadow it.
+from django.conf import settings as django_settings
+from django.http import JsonResponse
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control
 
 # Create your views here.
 
 from .models import Book, Author, ReadedBook
+from .autocomplete import author_suggestions
+from .caching import cache_anonymous_page
+from .search import search_books
+from .stats import get_dashboard_stats
 
+@cache_anonymous_page(Book, Author, ReadedBook)
 def index(request):
     """View function for home page of site."""
-    # Generate counts of some of the main objects
-    num_books = Book.objects.all().count()
-    num_instances = ReadedBook.objects.all().count()
-    # Available copies of books
-    num_instances_available = ReadedBook.objects.filter(status__exact='a').count()
-    num_authors = Author.objects.count()  # The 'all()' is implied by default.
-
-    # Number of visits to this view, as counted in the session variable.
-    num_visits = request.session.get('num_visits', 0)
-    request.session['num_visits'] = num_visits+1
+    # Counts of the main objects, worked out in one query and cached (see catalog.stats).
+    stats = get_dashboard_stats()
 
     # Render the HTML template index.html with the data in the context variable.
-    return render(
+    # The visit count is kept by the browser (see the template), so the page
+    # doesn't touch the session and is the same for every anonymous visitor.
+    response = render(
         request,
         'index.html',
-        context={'num_books': num_books, 'num_instances': num_instances,
-                 'num_instances_available': num_instances_available, 'num_authors': num_authors,
-                 'num_visits': num_visits},
+        context=stats,
     )
+    if not request.user.is_authenticated:
+        patch_cache_control(response, public=True, max_age=getattr(django_settings, 'CATALOG_INDEX_MAX_AGE', 60))
+    return response
+
+
+def author_autocomplete(request):
+    """JSON list of the authors whose name starts with ?q=, for AuthorAutocompleteWidget."""
+    return JsonResponse({'results': author_suggestions(request.GET.get('q', ''))})
+
+
+@cache_anonymous_page(Book, Author)
+def search(request):
+    """View function for ranked search across books and authors."""
+    query = request.GET.get('q', '').strip()
+    books = search_books(query) if query else []
+    return render(request, 'catalog/search_results.html', {'query': query, 'books': books})
+
+
+from . import circulation
+from .models import BookLoanDay
+
+# The periods, in days, the circulation pages can show.
+CIRCULATION_PERIODS = (7, 30, 365)
+
+
+def circulation_days(request):
+    try:
+        days = int(request.GET.get('days', 30))
+    except ValueError:
+        days = 30
+    return days if days in CIRCULATION_PERIODS else 30
+
+
+@cache_anonymous_page(BookLoanDay, Book, Author)
+def most_borrowed(request):
+    """View function for the most borrowed books, authors and catagories, read from the rollup tables."""
+    days = circulation_days(request)
+    return render(request, 'catalog/most_borrowed.html', dict(
+        circulation.most_borrowed(days), days=days, periods=CIRCULATION_PERIODS))
 
+
+@cache_anonymous_page(BookLoanDay)
+def loan_trends(request):
+    """View function for checkouts per catagory per day, read from the rollup tables."""
+    days = circulation_days(request)
+    rows, catagories = circulation.catagory_trends(days)
+    return render(request, 'catalog/loan_trends.html', {
+        'rows': rows, 'catagories': catagories, 'days': days, 'periods': CIRCULATION_PERIODS})
+
+from django.utils.decorators import method_decorator
 from django.views import generic
 
+from . import facets
+from .pagination import CursorPaginationMixin
 
 
-class BookListView(generic.ListView):
+
+@method_decorator(cache_anonymous_page(Book, Author, ReadedBook), name='dispatch')
+class BookListView(CursorPaginationMixin, generic.ListView):
     """Generic class-based view for a list of books."""
     model = Book
+    queryset = Book.objects.select_related('author')
     paginate_by = 10
+    cursor_ordering = ['title']
+
+    def get_cursor_ordering(self):
+        if self.request.GET.get('sort') == 'available':
+            # Walks book_available_idx.
+            return ['-copies_available', 'title', 'id']
+        return super().get_cursor_ordering()
+
+    def get_queryset(self):
+        # ?catagory=...&author=...&favourite=1&available=1 (see catalog.facets).
+        self.filters = facets.parse_filters(self.request.GET)
+        return facets.filter_books(super().get_queryset(), self.filters)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['facets'] = facets.facets(self.request.GET, self.filters)
+        return context
 
 
+@method_decorator(cache_anonymous_page(Book, Author, ReadedBook), name='dispatch')
 class BookDetailView(generic.DetailView):
     """Generic class-based detail view for a book."""
     model = Book
+    queryset = Book.objects.select_related('author')
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Lazy: only runs if the template's cached copies fragment is stale.
+        context['copies'] = self.object.readedbook_set.all()
+        return context
 
-class AuthorListView(generic.ListView):
+
+@method_decorator(cache_anonymous_page(Author), name='dispatch')
+class AuthorListView(CursorPaginationMixin, generic.ListView):
     """Generic class-based list view for a list of authors."""
     model = Author
     paginate_by = 10
 
 
+@method_decorator(cache_anonymous_page(Author, Book, ReadedBook), name='dispatch')
 class AuthorDetailView(generic.DetailView):
     """Generic class-based detail view for an author."""
     model = Author
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Each book carries its copy counters, so the template doesn't count per row.
+        # Lazy: only runs if the template's cached books fragment is stale.
+        context['books'] = self.object.book_set.all()
+        return context
+
 
-class ReadedBookListView(generic.ListView):
+@method_decorator(cache_anonymous_page(ReadedBook, Book), name='dispatch')
+class ReadedBookListView(CursorPaginationMixin, generic.ListView):
     """Generic class-based list view for a list of authors."""
     model = ReadedBook
+    queryset = ReadedBook.objects.select_related('book')
     paginate_by = 10
 
 
+@method_decorator(cache_anonymous_page(ReadedBook, Book), name='dispatch')
 class ReadedBookDetailView(generic.DetailView):
     """Generic class-based detail view for an author."""
     model = ReadedBook
+    queryset = ReadedBook.objects.select_related('book')
 
 from django.contrib.auth.mixins import LoginRequiredMixin
 
 
-class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
+class LoanedBooksByUserListView(LoginRequiredMixin, CursorPaginationMixin, generic.ListView):
     """Generic class-based view listing books on loan to current user."""
     model = ReadedBook
     template_name = 'catalog/readedbook_list_borrowed_user.html'
     paginate_by = 10
 
     def get_queryset(self):
-        return ReadedBook.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
+        return (ReadedBook.objects.filter(borrower=self.request.user).filter(status__exact='o')
+                .select_related('book').order_by('due_back'))
 
 
 # Added as part of challenge!
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 
 
-class LoanedBooksAllListView(LoginRequiredMixin, generic.ListView):
+class LoanedBooksAllListView(LoginRequiredMixin, CursorPaginationMixin, generic.ListView):
     """Generic class-based view listing all books on loan. Only visible to users with can_mark_returned permission."""
     model = ReadedBook
     permission_required = 'catalog.can_mark_returned'
@@ -87,7 +181,68 @@ class LoanedBooksAllListView(LoginRequiredMixin, generic.ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        return ReadedBook.objects.filter(status__exact='o').order_by('due_back')
+        return (ReadedBook.objects.filter(status__exact='o')
+                .select_related('book', 'borrower').order_by('due_back'))
+
+
+class OverdueBooksListView(PermissionRequiredMixin, CursorPaginationMixin, generic.ListView):
+    """Copies on loan past their due date, oldest first, for librarians chasing them up."""
+    model = ReadedBook
+    permission_required = 'catalog.can_mark_returned'
+    template_name = 'catalog/readedbook_list_overdue.html'
+    paginate_by = 20
+
+    def get_queryset(self):
+        return ReadedBook.objects.overdue().select_related('book', 'borrower').order_by('due_back')
+
+
+import csv
+import datetime
+
+from django.contrib.auth.decorators import permission_required
+from django.http import StreamingHttpResponse
+
+
+class Echo:
+    """File-like object that hands back what is written to it, for streaming csv output."""
+
+    def write(self, value):
+        return value
+
+
+LEDGER_COLUMNS = ['copy_id', 'title', 'imprint', 'borrower', 'due_back', 'overdue']
+
+
+@permission_required('catalog.can_mark_returned')
+def loan_ledger_csv(request):
+    """Stream every copy on loan as CSV, reading the rows in server-side chunks."""
+    rows = (ReadedBook.objects.filter(status__exact='o').order_by('due_back', 'id')
+            .values_list('id', 'book__title', 'imprint', 'borrower__username', 'due_back')
+            .iterator(chunk_size=2000))
+    today = datetime.date.today()
+    writer = csv.writer(Echo())
+
+    def lines():
+        yield writer.writerow(LEDGER_COLUMNS)
+        for copy_id, title, imprint, borrower, due_back in rows:
+            yield writer.writerow([copy_id, title, imprint, borrower or '', due_back or '',
+                                   'yes' if due_back and due_back < today else 'no'])
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="loan-ledger-{0}.csv"'.format(today.isoformat())
+    return response
+
+
+from django.http import Http404, HttpResponse
+
+from . import instrumentation
+
+
+def metrics(request):
+    """Request timings and query counts (see catalog.instrumentation), for a Prometheus scraper holding the token."""
+    if not instrumentation.metrics_allowed(request):
+        raise Http404
+    return HttpResponse(instrumentation.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 from django.shortcuts import get_object_or_404
@@ -98,6 +253,7 @@ from django.contrib.auth.decorators import permission_required
 
 # from .forms import RenewBookForm
 from catalog.forms import RenewBookForm
+from catalog.loans import renew_copies
 
 
 @permission_required('catalog.can_mark_returned')
@@ -113,12 +269,13 @@ def renew_book_librarian(request, pk):
 
         # Check if the form is valid:
         if form.is_valid():
-            # process the data in form.cleaned_data as required (here we just write it to the model due_back field)
-            readed_book.due_back = form.cleaned_data['renewal_date']
-            readed_book.save()
-
-            # redirect to a new URL:
-            return HttpResponseRedirect(reverse('all-borrowed'))
+            # Only moves the due date if the copy is still on loan, so a return
+            # recorded since the form was shown isn't undone.
+            if renew_copies([readed_book.pk], form.cleaned_data['renewal_date']):
+                # redirect to a new URL:
+                return HttpResponseRedirect(reverse('all-borrowed'))
+            readed_book.refresh_from_db()
+            form.add_error(None, 'This copy is {0}, not on loan.'.format(readed_book.get_status_display().lower()))
 
     # If this is a GET (or any other method) create the default form
     else:
@@ -133,6 +290,120 @@ def renew_book_librarian(request, pk):
     return render(request, 'catalog/book_renew_librarian.html', context)
 
 
+from .forms import BulkLoanForm
+from .loans import renew_copies, return_copies
+
+
+@permission_required('catalog.can_mark_returned')
+def bulk_loans(request):
+    """View function for a librarian to renew or return many copies in one go."""
+    result = None
+    if request.method == 'POST':
+        form = BulkLoanForm(request.POST)
+        if form.is_valid():
+            ids = form.cleaned_data['copies']
+            if form.cleaned_data['action'] == 'renew':
+                touched = renew_copies(ids, form.cleaned_data['renewal_date'])
+            else:
+                touched = return_copies(ids)
+            # Ids that were unknown or not on loan are left alone and listed.
+            result = {
+                'action': form.cleaned_data['action'],
+                'touched': touched,
+                'skipped': sorted(set(ids) - set(touched)),
+            }
+    else:
+        form = BulkLoanForm(initial={
+            'copies': ' '.join(request.GET.getlist('copies')),
+            'renewal_date': datetime.date.today() + datetime.timedelta(weeks=3),
+        })
+    return render(request, 'catalog/bulk_loans.html', {'form': form, 'result': result})
+
+
+from . import loans
+from .forms import LendCopyForm, ReturnCopyForm
+from .models import Hold
+
+
+@permission_required('catalog.can_mark_returned')
+def lend_copy(request, pk):
+    """View function for a librarian to lend a copy, to the reader it is kept for if it is reserved."""
+    readed_book = get_object_or_404(ReadedBook.objects.select_related('book'), pk=pk)
+    hold = Hold.objects.filter(copy=readed_book).select_related('user').first()
+    if request.method == 'POST':
+        form = LendCopyForm(request.POST)
+        if form.is_valid():
+            borrower, due_back = form.cleaned_data['borrower'], form.cleaned_data['due_back']
+            try:
+                if hold is not None and hold.user == borrower:
+                    loans.collect_hold(hold, due_back)
+                else:
+                    loans.checkout(pk, borrower, due_back, expected_version=form.cleaned_data['version'])
+            except loans.LoanConflict as exc:
+                form.add_error(None, str(exc))
+            else:
+                return HttpResponseRedirect(reverse('book-detail', args=[readed_book.book_id]))
+    else:
+        form = LendCopyForm(initial={
+            'borrower': hold.user.username if hold is not None else '',
+            'due_back': datetime.date.today() + datetime.timedelta(weeks=3),
+            'version': readed_book.version,
+        })
+    return render(request, 'catalog/readedbook_lend.html', {'form': form, 'readed_book': readed_book, 'hold': hold})
+
+
+@permission_required('catalog.can_mark_returned')
+def return_copy(request, pk):
+    """View function for a librarian to take back a copy; it goes to the next hold on the book, if any."""
+    readed_book = get_object_or_404(ReadedBook.objects.select_related('book', 'borrower'), pk=pk)
+    if request.method == 'POST':
+        form = ReturnCopyForm(request.POST)
+        if form.is_valid():
+            try:
+                loans.return_copy(pk, expected_version=form.cleaned_data['version'])
+            except loans.LoanConflict as exc:
+                form.add_error(None, str(exc))
+            else:
+                return HttpResponseRedirect(reverse('book-detail', args=[readed_book.book_id]))
+    else:
+        form = ReturnCopyForm(initial={'version': readed_book.version})
+    return render(request, 'catalog/readedbook_return.html', {'form': form, 'readed_book': readed_book})
+
+
+from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
+
+from . import holds
+from .models import Hold
+
+
+@login_required
+@require_POST
+def place_hold(request, pk):
+    """Join the queue for the next copy of a book."""
+    book = get_object_or_404(Book, pk=pk)
+    holds.place_hold(book, request.user)
+    return HttpResponseRedirect(reverse('my-holds'))
+
+
+@login_required
+@require_POST
+def cancel_hold(request, pk):
+    """Leave a book's queue, passing any copy kept for the hold to the next reader."""
+    holds.cancel_hold(get_object_or_404(Hold, pk=pk, user=request.user))
+    return HttpResponseRedirect(reverse('my-holds'))
+
+
+class HoldsByUserListView(LoginRequiredMixin, generic.ListView):
+    """The current user's holds with their place in each queue, worked out in the same query."""
+    template_name = 'catalog/hold_list_user.html'
+    context_object_name = 'hold_list'
+
+    def get_queryset(self):
+        return holds.with_positions(
+            Hold.objects.filter(user=self.request.user).select_related('book', 'copy').order_by('created_at', 'id'))
+
+
 
 from django.urls import reverse
 from django.db.models import Count
@@ -152,7 +423,9 @@ from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
 from .models import Author
 
-from .forms import BookForm, ReviewForm
+from . import reviews
+from .forms import BookEditForm, BookForm, ClaimReviewsForm, ReadedBookForm, ReviewForm
+from .loans import LoanConflict, change_copy
 
 
 class AuthorCreate(LoginRequiredMixin, CreateView):
@@ -177,7 +450,7 @@ class AuthorDelete(LoginRequiredMixin, DeleteView):
 # Classes created for the forms challenge
 class BookCreate(LoginRequiredMixin, CreateView):
     model = Book
-    fields = ['cover', 'title', 'catagory', 'author' ]
+    form_class = BookEditForm
     permission_required = 'catalog.can_mark_returned'
 
 
@@ -195,7 +468,7 @@ def book_form(request):
 
 class BookUpdate(LoginRequiredMixin, UpdateView):
     model = Book
-    fields = ['cover', 'title', 'catagory', 'author' ]
+    form_class = BookEditForm
     permission_required = 'catalog.can_mark_returned'
 
 
@@ -213,61 +486,94 @@ class ReadedBookCreate(LoginRequiredMixin, CreateView):
 
 class ReadedBookUpdate(LoginRequiredMixin, UpdateView):
     model = ReadedBook
-    fields = '__all__'
+    form_class = ReadedBookForm
     permission_required = 'catalog.can_mark_returned'
 
+    def form_valid(self, form):
+        changes = {name: form.cleaned_data[name] for name in form._meta.fields}
+        try:
+            self.object = change_copy(self.object.pk, changes, expected_version=form.cleaned_data['version'])
+        except LoanConflict as exc:
+            form.add_error(None, str(exc))
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
+
 
 class ReadedBookDelete(LoginRequiredMixin, DeleteView):
     model = ReadedBook
     success_url = reverse_lazy('readedbooks')
     permission_required = 'catalog.can_mark_returned'
 
-class ReviewList(View):
+class ReviewList(CursorPaginationMixin, ListView):
     """
-    List all of the books that we want to review.
+    List all of the books that we want to review, a page at a time in queue order.
     """
-    def get(self, request):
-        books = Book.objects.filter(date_reviewed__isnull=True).prefetch_related('author')
+    model = Book
+    paginate_by = 25
+    cursor_ordering = ['id']
+    context_object_name = 'books'
+    template_name = 'catalog/list-to-review.html'
 
-        context = {
-            'books': books,
-            'form': BookForm,
-        }
+    def get_queryset(self):
+        # Walks book_unreviewed_idx.
+        return reviews.pending().select_related('author', 'reviewed_by')
 
-        return render(request, "catalog/list-to-review.html", context)
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.setdefault('form', BookForm)
+        context['claimed'] = reviews.claimed_by(self.request.user).select_related('author')
+        context['claim_form'] = ClaimReviewsForm
+        return context
 
     def post(self, request):
         form = BookForm(request.POST)
-        books = Book.objects.filter(date_reviewed__isnull=True).prefetch_related('author')
 
         if form.is_valid():
             form.save()
             return redirect('review-books')
 
-        context = {
-            'form':form,
-            'books':books,
-        }
-        return render(request,'catalog/list-to-review.html',context)
+        self.object_list = self.get_queryset()
+        return self.render_to_response(self.get_context_data(form=form))
+
+
+@login_required
+@require_POST
+def claim_reviews(request):
+    """Lease the next few unclaimed books to the reviewer."""
+    form = ClaimReviewsForm(request.POST)
+    if form.is_valid():
+        # The list page shows what was claimed, under "Your books to review".
+        reviews.claim_next(request.user, form.cleaned_data['count'])
+    return redirect('review-books')
+
+
+@login_required
+@require_POST
+def release_review(request, pk):
+    """Put a claimed book back in the queue."""
+    reviews.release(request.user, pk)
+    return redirect('review-books')
 
 
+@login_required
 def review_book(request, pk):
     """
     Review an individual book
     """
-    book = get_object_or_404(Book, pk=pk)
+    book = get_object_or_404(Book.objects.select_related('author'), pk=pk)
 
     if request.method == 'POST':
         # process our form
         form = ReviewForm(request.POST)
 
         if form.is_valid():
-            book.is_favourite = form.cleaned_data['is_favourite']
-            book.review = form.cleaned_data['review']
-            book.reviewed_by = request.user
-            book.save()
-
-            return redirect('review-books')
+            try:
+                reviews.complete_review(book.pk, request.user, form.cleaned_data['review'],
+                                        form.cleaned_data['is_favourite'])
+            except reviews.ReviewConflict as exc:
+                form.add_error(None, str(exc))
+            else:
+                return redirect('review-books')
 
     else:
         form = ReviewForm
@@ -292,9 +598,9 @@ from django.shortcuts import render, redirect
 from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.template.loader import render_to_string
-from django.core.mail import EmailMessage
 
 from catalog.forms import SignUpForm
+from catalog.outbox import queue_email
 from catalog.tokens import account_activation_token
 
 
@@ -315,8 +621,8 @@ def signup(request):
                 'token': account_activation_token.make_token(user),
             })
             to_email = form.cleaned_data.get('email')
-            email = EmailMessage(email_subject, message, to=[to_email])
-            email.send()
+            # Sent by the send_queued_email worker, not while the user waits.
+            queue_email(email_subject, message, [to_email])
             return redirect('account_activation_sent')
     else:
         form = SignUpForm()